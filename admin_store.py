@@ -0,0 +1,70 @@
+# admin_store.py
+
+import copy
+import json
+import os
+import threading
+import file_lock
+
+DEFAULT_PERMISSIONS = ["add_admin", "remove_admin", "reset_2fa"]
+
+class AdminStore:
+    # admin_secrets.json ({email: {"secret", "qr_shown", "permissions"}}),
+    # parsed once per version of the file. Every reader checks the file's
+    # stat first, so a write from any process is seen by the next request.
+    # Writes are serialized by a lock file and replace the file in one
+    # rename, so nobody reads half of one.
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self._stat = None
+        self._admins = {}
+
+    def _file_stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def admins(self):
+        # The current {email: record} mapping. Shared by every caller, so it
+        # must not be modified; use update() to change it.
+        stat = self._file_stat()
+        with self.lock:
+            if stat != self._stat:
+                admins = {}
+                if stat is not None:
+                    with open(self.path, encoding="utf-8") as f:
+                        admins = json.load(f)
+                self._admins, self._stat = admins, stat
+            return self._admins
+
+    def is_admin(self, email):
+        return bool(email) and email in self.admins()
+
+    def emails(self):
+        return list(self.admins())
+
+    def get(self, email):
+        return self.admins().get(email)
+
+    def permissions(self, email):
+        return (self.get(email) or {}).get("permissions", [])
+
+    def update(self, change):
+        # Calls change(admins) on a private copy of the current mapping and
+        # writes the result if change returns anything but False. The whole
+        # read-modify-write holds a lock shared with every other process.
+        with file_lock.file_lock(self.path + ".lock"):
+            admins = copy.deepcopy(self.admins())
+            result = change(admins)
+            if result is not False:
+                file_lock.replace_file(self.path, json.dumps(admins, indent=2))
+                with self.lock:
+                    self._admins, self._stat = admins, self._file_stat()
+        return result
+
+def new_admin(secret):
+    return {"secret": secret, "qr_shown": False, "permissions": list(DEFAULT_PERMISSIONS)}
@@ -1,22 +1,32 @@
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify, send_file, abort
+from flask import Flask, render_template, request, redirect, session, url_for, jsonify, send_file, Response
 import os
 import json
+import time
 import pyotp
 from scraper import scrape_trials
-from matcher import run_screening
+import http_cache
+import jobs
+import catalogue
+import eligibility_cache
+import match_index
+import patient_store
+import patient_db
+import log_store
+import admin_store
+import metrics
+from matcher import run_screening, get_screening, result_page, PAGE_SIZE
 from io import BytesIO
 import qrcode
-import csv
 from functools import wraps
-import datetime
-import dateutil.parser
 app = Flask(__name__)
+metrics.instrument(app)
 
 app.secret_key = 'your-secret-key'
 
 ADMIN_SECRETS_FILE = "admin_secrets.json"
 
 UPLOAD_FOLDER = 'uploads'
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
@@ -25,13 +35,10 @@ def require_permission(permission_name):
         @wraps(f)
         def wrapped(*args, **kwargs):
             email = session.get("email")
-            if email not in ADMIN_EMAILS:
+            if not is_admin(email):
                 return jsonify({"success": False, "error": "Unauthorized"}), 403
 
-            secrets = load_admin_secrets()
-            perms = secrets.get(email, {}).get("permissions", [])
-
-            if permission_name not in perms:
+            if permission_name not in admins.permissions(email):
                 return jsonify({"success": False, "error": "No permission to do this action"}), 403
 
             return f(*args, **kwargs)
@@ -39,87 +46,101 @@ def require_permission(permission_name):
     return decorator
 
 
-def load_admin_secrets():
-    if not os.path.exists(ADMIN_SECRETS_FILE):
-        return {}
-    with open(ADMIN_SECRETS_FILE, encoding='utf-8') as f:
-        return json.load(f)
-
+admins = admin_store.AdminStore(ADMIN_SECRETS_FILE)
 
-def save_admin_secrets(secrets):
-    with open(ADMIN_SECRETS_FILE, "w", encoding='utf-8') as f:
-        json.dump(secrets, f, indent=2)
+def load_admin_secrets():
+    # Cached; re-read only when the file changes. Do not modify the result.
+    return admins.admins()
 
 
-def load_admin_emails():
-    return set(load_admin_secrets().keys())
+def is_admin(email):
+    return admins.is_admin(email)
 
-ADMIN_EMAILS = load_admin_emails()
 
 def get_or_create_secret(email):
-    secrets = load_admin_secrets()
-    if email not in secrets:
-        secrets[email] = {
-            "secret": pyotp.random_base32(),
-            "qr_shown": False,
-            "permissions": ["add_admin", "remove_admin", "reset_2fa"] # These are default permissions.
-        }
-        save_admin_secrets(secrets)
-    return secrets[email]["secret"]
+    def create(secrets):
+        if email in secrets:
+            return False
+        secrets[email] = admin_store.new_admin(pyotp.random_base32())
+    admins.update(create)
+    return admins.get(email)["secret"]
 
 
 def mark_qr_as_shown(email):
-    secrets = load_admin_secrets()
-    if email in secrets:
+    def mark(secrets):
+        if email not in secrets or secrets[email].get("qr_shown"):
+            return False
         secrets[email]["qr_shown"] = True
-        save_admin_secrets(secrets)
+    admins.update(mark)
 
 
 def reset_admin_2fa(email):
-    secrets = load_admin_secrets()
-    secrets[email] = {
-        "secret": pyotp.random_base32(),
-        "qr_shown": False,
-        "permissions": ["add_admin", "remove_admin", "reset_2fa"]
-    }
-    save_admin_secrets(secrets)
+    def reset(secrets):
+        secrets[email] = admin_store.new_admin(pyotp.random_base32())
+    admins.update(reset)
 
 
 def remove_admin(email):
-    secrets = load_admin_secrets()
-    if email in secrets:
-        del secrets[email]
-        save_admin_secrets(secrets)
-        ADMIN_EMAILS.discard(email)
+    def remove(secrets):
+        if secrets.pop(email, None) is None:
+            return False
+    admins.update(remove)
+
+def load_patient_table(patient_file):
+    with metrics.span("patient_load_duration_seconds", kind="table"):
+        return patient_store.load(patient_file)
 
 def get_user_patient_file():
-    return session.get("patient_file")
+    patient_file = session.get("patient_file")
+    if patient_file and not patient_db.is_patient_db(patient_file) and os.path.exists(patient_file):
+        # Sessions from before uploads were imported into a patient database.
+        with metrics.span("patient_load_duration_seconds", kind="csv_import"):
+            patient_file = session["patient_file"] = patient_db.import_csv(patient_file)
+    return patient_file
+
+LOG_FILE = "logs.json"  # the old single-file log, imported into LOG_DIR on first start
+LOG_DIR = "logs"
 
-LOG_FILE = "logs.json"
+audit_log = log_store.LogStore(LOG_DIR, fsync=log_store.FSYNC_INTERVAL, legacy_file=LOG_FILE)
 
 def add_log(action, user_email, details=""):
-    log_entry = {
-        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        "email": user_email,
-        "action": action,
-        "details": details
+    audit_log.append(log_store.new_entry(action, user_email, details))
+
+def log_json(log):
+    # "timestamp" is for display; deletes identify an entry by "logged_at".
+    return {
+        "action": log.get("action", ""),
+        "email": log.get("email", ""),
+        "details": log.get("details", ""),
+        "timestamp": log.get("time", ""),
+        "logged_at": log.get("timestamp", ""),
     }
-    logs = {}
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, encoding="utf-8") as f:
-            logs = json.load(f)
-    if user_email not in logs:
-        logs[user_email] = []
-    logs[user_email].append(log_entry)
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        json.dump(logs, f, indent=2)
-
-def format_timestamp(ts):
+
+def log_filters():
+    # Shared ?since=&until=&action= arguments of the log queries; raises ValueError.
+    filters = {"action": request.args.get("action", "").strip().upper() or None}
+    for name in ("since", "until"):
+        value = request.args.get(name, "").strip()
+        filters[name] = log_store.normalize_timestamp(value) if value else None
+        if value and filters[name] is None:
+            raise ValueError(f"{name} must be an ISO date or time")
+    return filters
+
+def log_page(email=None):
     try:
-        dt = dateutil.parser.isoparse(ts)
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-    except:
-        return ts
+        filters = log_filters()
+        cursor = request.args.get("cursor")
+        cursor = log_store.decode_cursor(cursor) if cursor else None
+        limit = min(max(int(request.args.get("limit", log_store.QUERY_LIMIT)), 1), log_store.MAX_QUERY_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": str(e) or "Invalid query"}), 400
+    page = audit_log.query(email=email, cursor=cursor, limit=limit, **filters)
+    return jsonify({
+        "logs": [log_json(log) for log in page["entries"]],
+        "total": page["total"],
+        "next_cursor": page["next_cursor"] and log_store.encode_cursor(page["next_cursor"]),
+    })
+
 @app.route("/")
 def root():
     return redirect(url_for("home" if session.get("logged_in") else "login"))
@@ -127,7 +148,7 @@ def root():
 @app.route("/login", methods=["GET", "POST"])
 def login():
     def is_valid_patient_id(email):
-        if email.lower() in ADMIN_EMAILS:
+        if is_admin(email.lower()):
             return True
         if not email.endswith("@hse.ie"):
             return False
@@ -152,28 +173,22 @@ def home():
 
 
     email = session["email"]
-    is_admin = email in ADMIN_EMAILS
+    admin = is_admin(email)
     is_verified = session.get("admin_verified", False)
     patient_id = email.split("@")[0]
     patient_info = {}
 
 
     patient_file = get_user_patient_file()
-    patients = []
+    patients = {"total": 0, "patients": [], "next_cursor": None}
     if patient_file and os.path.exists(patient_file):
-        with open(patient_file, newline='', encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                patients.append({
-                    "name": row.get("Patient name", "").strip(),
-                    "cancer": row.get("Cancer type", "").strip(),
-                    "id": row.get("Patient ID", "").strip()
-                })
+        # Only the first page is embedded; the list fetches the rest from /patients.
+        patients = load_patient_table(patient_file).query()
 
     return render_template(
         "index.html",
         patient_info=patient_info,
-        is_admin=is_admin,
+        is_admin=admin,
         admin_verified=is_verified,
         patient_list=patients
 )
@@ -181,7 +196,7 @@ def home():
 @app.route("/admin_qr")
 def admin_qr():
     email = session.get("email")
-    if email not in ADMIN_EMAILS:
+    if not is_admin(email):
         return "Unauthorized", 403
 
     secret = get_or_create_secret(email)
@@ -195,7 +210,7 @@ def admin_qr():
 @app.route("/admin_qr_shown", methods=["POST"])
 def admin_qr_shown():
     email = session.get("email")
-    if email in ADMIN_EMAILS:
+    if is_admin(email):
         mark_qr_as_shown(email)
         return jsonify({"success": True})
     return jsonify({"error": "Unauthorized"}), 403
@@ -203,7 +218,7 @@ def admin_qr_shown():
 @app.route("/verify_2fa", methods=["POST"])
 def verify_2fa():
     email = session.get("email")
-    if email not in ADMIN_EMAILS:
+    if not is_admin(email):
         return jsonify({"success": False, "error": "Unauthorized"}), 403
 
     data = request.get_json()
@@ -225,12 +240,11 @@ def verify_2fa():
 def add_admin():
     data = request.get_json()
     new_email = data.get("email", "").strip().lower()
-    if not new_email.endswith("@hse.ie") or new_email in ADMIN_EMAILS:
+    if not new_email.endswith("@hse.ie") or is_admin(new_email):
         return jsonify({"success": False, "error": "Invalid or duplicate email"})
 
-    ADMIN_EMAILS.add(new_email)
     get_or_create_secret(new_email)
-    return jsonify({"success": True, "admins": list(ADMIN_EMAILS)})
+    return jsonify({"success": True, "admins": admins.emails()})
 
 @app.route("/remove_admin", methods=["POST"])
 @require_permission("remove_admin")
@@ -238,7 +252,7 @@ def remove_admin_route():
     data = request.get_json()
     target_email = data.get("target_email")
 
-    if target_email not in ADMIN_EMAILS:
+    if not is_admin(target_email):
         return jsonify({"success": False, "error": "Target not an admin"})
 
     remove_admin(target_email)
@@ -250,7 +264,7 @@ def reset_2fa_route():
     data = request.get_json()
     target_email = data.get("target_email")
 
-    if target_email not in ADMIN_EMAILS:
+    if not is_admin(target_email):
         return jsonify({"success": False, "error": "Target not an admin"})
 
     reset_admin_2fa(target_email)
@@ -259,14 +273,14 @@ def reset_2fa_route():
 @app.route("/admin_list")
 def admin_list():
     email = session.get("email")
-    if email not in ADMIN_EMAILS:
+    if not is_admin(email):
         return jsonify({"error": "Unauthorized"}), 403
-    return jsonify({"admins": list(ADMIN_EMAILS)})
+    return jsonify({"admins": admins.emails()})
 
 @app.route("/admin_status")
 def admin_status():
     email = session.get("email")
-    if email not in ADMIN_EMAILS:
+    if not is_admin(email):
         return jsonify({"error": "Unauthorized"}), 403
 
     secrets = load_admin_secrets()
@@ -279,8 +293,7 @@ def admin_entry():
     if not session.get("logged_in"):
         return redirect(url_for("login"))
 
-    is_admin = email in ADMIN_EMAILS
-    if not is_admin:
+    if not is_admin(email):
         return "You are not authorized to view this page.", 403
 
     return render_template("admin_login.html", is_admin=True)
@@ -289,7 +302,7 @@ def admin_entry():
 @app.route("/admin_panel")
 def admin_panel():
     email = session.get("email")
-    if email not in ADMIN_EMAILS or not session.get("admin_verified"):
+    if not is_admin(email) or not session.get("admin_verified"):
         return redirect(url_for("admin_entry"))
     return render_template("admin_panel.html", is_admin=True)
 
@@ -306,83 +319,213 @@ def admin_permissions():
 
 @app.route("/set_permissions", methods=["POST"])
 def set_permissions():
-    if session.get("email") not in ADMIN_EMAILS:
+    if not is_admin(session.get("email")):
         return jsonify({"success": False, "error": "Unauthorized"}), 403
 
     data = request.get_json()
     target_email = data.get("email", "").lower()
     permissions = data.get("permissions", [])
 
-    secrets = load_admin_secrets()
-    if target_email not in secrets:
+    def set_target(secrets):
+        if target_email not in secrets:
+            return False
+        secrets[target_email]["permissions"] = permissions
+    if admins.update(set_target) is False:
         return jsonify({"success": False, "error": "Target admin not found"}), 404
-
-    secrets[target_email]["permissions"] = permissions
-    save_admin_secrets(secrets)
     return jsonify({"success": True, "message": "Permissions updated"})
 
+def trial_to_json(record):
+    # Trials without a countable exclusion section sort last as inf, which JSON can't carry.
+    exclusion_count = record["exclusion_count"]
+    return {
+        "name": record["name"],
+        "nct_id": record["nct_id"],
+        "link": record["link"],
+        "eligibility": record["eligibility"],
+        "exclusion_count": None if exclusion_count == float("inf") else exclusion_count
+    }
+
+def run_scrape_job(job, cancer_type, country):
+    records = scrape_trials(cancer_type, country, on_trial=lambda record: job.add_trial(trial_to_json(record)))
+    return [trial_to_json(record) for record in records]
+
 @app.route("/scrape", methods=["POST"])
 def scrape_route():
     data = request.get_json()
     cancer_type = data.get("cancer_type")
     country = data.get("country", "Ireland")
-    filepaths = scrape_trials(cancer_type, country)
+    if not cancer_type:
+        return jsonify({"success": False, "error": "Missing cancer type"}), 400
+
+    key = (cancer_type.strip().lower(), country.strip().lower())
+    job, created = jobs.submit(key, run_scrape_job, cancer_type, country)
+    return jsonify({"success": True, "job_id": job.id, "status": job.status, "coalesced": not created}), 202
+
+@app.route("/scrape_status/<job_id>")
+def scrape_status(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+    since = request.args.get("since", 0, type=int)
+    return jsonify({"success": True, **job.snapshot(since)})
+
+@app.route("/scrape_events/<job_id>")
+def scrape_events(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job"}), 404
+
+    def event(name, payload):
+        return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+    def stream():
+        sent = 0
+        while True:
+            job.wait(sent, timeout=15)
+            snapshot = job.snapshot(sent)
+            for trial in snapshot["trials"]:
+                yield event("trial", trial)
+            sent = snapshot["count"]
+            if snapshot["status"] == "done":
+                yield event("done", {"trials": snapshot["result"]})
+                return
+            if snapshot["status"] == "failed":
+                yield event("failed", {"error": snapshot["error"]})
+                return
+            if not snapshot["trials"]:
+                yield ": keep-alive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/trials")
+def trials_route():
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Unauthorized"}), 403
+    trials = catalogue.find_trials(
+        country=request.args.get("country"),
+        cancer_type=request.args.get("cancer"),
+        status=request.args.get("status"),
+    )
+    return jsonify({"success": True, "trials": [
+        {
+            "trial_id": t["trial_id"],
+            "name": t["name"],
+            "link": t["link"],
+            "status": t["status"],
+            "inclusion": t["inclusion"],
+            "exclusion": t["exclusion"],
+            "exclusion_count": None if t["exclusion_count"] == float("inf") else t["exclusion_count"],
+        }
+        for t in trials
+    ]})
 
-    def format_trials_from_paths(paths):
-        trials_output = []
-        for path in paths:
-            try:
-                with open(path, encoding="utf-8") as f:
-                    reader = csv.reader(f)
-                    trial = {"name": "Unnamed Trial", "eligibility": "N/A", "link": "#"}
-                    for row in reader:
-                        if row and row[0].startswith("Name:"):
-                            trial["name"] = row[1]
-                        elif row and row[0].startswith("More Detailed Information:"):
-                            trial["link"] = row[1]
-                        elif row and "Eligibility Criteria" in row[0]:
-                            trial["eligibility"] = row[1] if len(row) > 1 else row[0].split(":")[-1]
-                    trials_output.append(trial)
-            except:
-                pass
-        return trials_output
-
-    return jsonify({"trials": format_trials_from_paths(filepaths)})
+@app.route("/search_trials")
+def search_trials():
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"success": False, "error": "Missing query"}), 400
+    try:
+        results = catalogue.search(
+            query,
+            section=request.args.get("section") or None,
+            country=request.args.get("country"),
+            cancer_type=request.args.get("cancer"),
+            status=request.args.get("status"),
+            limit=min(max(request.args.get("limit", 20, type=int), 1), 100),
+            offset=max(request.args.get("offset", 0, type=int), 0),
+        )
+    except ValueError as e:
+        return jsonify({"success": False, "error": str(e)}), 400
+    for result in results:
+        if result["exclusion_count"] == float("inf"):
+            result["exclusion_count"] = None
+    return jsonify({"success": True, "results": results})
+
+@app.route("/admin_cache")
+def admin_cache():
+    if not is_admin(session.get("email")):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({"cache": http_cache.cache_stats()})
+
+@app.route("/admin_cache_purge", methods=["POST"])
+def admin_cache_purge():
+    if not is_admin(session.get("email")):
+        return jsonify({"success": False, "error": "Unauthorized"}), 403
+
+    data = request.get_json(silent=True) or {}
+    url_class = data.get("url_class")
+    if url_class and url_class not in http_cache.CACHE_TTLS:
+        return jsonify({"success": False, "error": "Unknown URL class"}), 400
+
+    deleted = http_cache.purge(url_class)
+    add_log("CACHE_PURGE", session["email"], f"Purged {deleted} cached responses ({url_class or 'all'})")
+    return jsonify({"success": True, "deleted": deleted})
 
 @app.route("/patient_names")
 def patient_names():
     patient_file = get_user_patient_file()
     if not patient_file or not os.path.exists(patient_file):
         return "No patient file uploaded.", 400
-    patients = []
     try:
-        with open(patient_file, newline='', encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                name = row.get("Patient name", "").strip()
-                cancer = row.get("Cancer type", "").strip()
-                if name:
-                    patients.append({"name": name, "cancer": cancer})
+        table = load_patient_table(patient_file)
+        patients = [p for p in table.summaries(table.search(request.args.get("q", ""))) if p["name"]]
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
     return jsonify({"success": True, "patients": patients})
 
+@app.route("/patients")
+def patients_page():
+    patient_file = get_user_patient_file()
+    if not patient_file or not os.path.exists(patient_file):
+        return jsonify({"success": False, "error": "No patient file uploaded"}), 400
+    sort = request.args.get("sort", "row")
+    if sort != "row" and sort not in patient_store.SORT_COLUMNS:
+        return jsonify({"success": False, "error": f"Unknown sort '{sort}'"}), 400
+    try:
+        cursor = request.args.get("cursor")
+        cursor = patient_store.decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+    result = load_patient_table(patient_file).query(
+        q=request.args.get("q", ""),
+        cancer=request.args.get("cancer", ""),
+        country=request.args.get("country", ""),
+        sort=sort,
+        cursor=cursor,
+        offset=max(request.args.get("offset", 0, type=int), 0),
+        limit=min(max(request.args.get("limit", patient_store.PAGE_SIZE, type=int), 1), 1000),
+    )
+    return jsonify({"success": True, **result})
+
 @app.route("/get_patient", methods=["GET"])
 def get_patient():
     patient_file = get_user_patient_file()
     if not patient_file or not os.path.exists(patient_file):
         return "No patient file uploaded.", 400
 
-    patient_id = request.args.get("patient_id", "").strip().lower()
+    patient_id = request.args.get("patient_id", "")
     try:
-        with open(patient_file, newline='', encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("Patient ID", "").strip().lower() == patient_id:
-                    return jsonify({"success": True, "patient": row})
+        patient, version = load_patient_table(patient_file).get_with_version(patient_id)
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
-    return jsonify({"success": False, "error": "Patient not found"}), 404
+    if patient is None:
+        return jsonify({"success": False, "error": "Patient not found"}), 404
+    return jsonify({"success": True, "patient": patient, "version": version})
+
+def valid_version(value):
+    # An absent "_version" skips the conflict check; anything else must be
+    # a row version (an integer).
+    if value is None:
+        return True
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        return False
+    return True
 
 @app.route("/update_patient", methods=["POST"])
 def update_patient():
@@ -390,57 +533,156 @@ def update_patient():
     if not patient_file or not os.path.exists(patient_file):
         return "No patient file uploaded.", 400
 
-    data = request.get_json()
-    if not data or "Patient ID" not in data:
+    data = request.get_json(silent=True)
+    patient_id = patient_db.patient_id_of(data) if isinstance(data, dict) else None
+    if patient_id is None:
         return jsonify({"success": False, "error": "Missing patient ID"}), 400
-
-    updated = False
-    changes = []
+    if not valid_version(data.get("_version")):
+        return jsonify({"success": False, "error": "Invalid _version"}), 400
 
     try:
-        with open(patient_file, newline='', encoding="utf-8") as f:
-            patients = list(csv.DictReader(f))
-
-        for row in patients:
-            if row["Patient ID"].strip().lower() == data["Patient ID"].strip().lower():
-                for key in row.keys():
-                    if key in data:
-                        old_value = row[key].strip()
-                        new_value = data[key].strip()
-                        if old_value != new_value:
-                            row[key] = new_value
-                            changes.append(f"{key}: '{old_value}' → '{new_value}'")
-                if changes:
-                    change_details = "; ".join(changes)
-                    add_log("EDIT", session["email"], f"Patient ID {data['Patient ID']}: {change_details}")
-                updated = True
-                break
-
-        if not updated:
-            return jsonify({"success": False, "error": "Patient not found"}), 404
-
-        with open(patient_file, "w", newline='', encoding="utf-8") as f:
-            writer = csv.DictWriter(f, fieldnames=patients[0].keys())
-            writer.writeheader()
-            writer.writerows(patients)
-
-        if changes:
-            change_details = "; ".join([f"{c['field']}: '{c['from']}' -> '{c['to']}'" for c in changes])
-            add_log("EDIT", session["email"], f"Patient ID {data['Patient ID']} changes: {change_details}")
+        result = patient_db.update_row(patient_file, patient_id, data, data.get("_version"))
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
 
-        return jsonify({"success": True})
+    if "error" in result:
+        return jsonify({"success": False, "error": result["error"]}), 400
+    if not result["found"]:
+        return jsonify({"success": False, "error": "Patient not found"}), 404
+    if result["conflict"]:
+        return jsonify({"success": False, "error": "Patient was changed by someone else",
+                        "version": result["version"]}), 409
+
+    changes = result["changes"]
+    if changes:
+        change_details = "; ".join(f"{field}: '{old}' → '{new}'" for field, old, new in changes)
+        add_log("EDIT", session["email"], f"Patient ID {patient_id}: {change_details}")
+        eligibility_cache.invalidate_patient(patient_id)
+
+    return jsonify({"success": True, "changed": bool(changes), "version": result["version"]})
 
+MAX_BULK_ROWS = 5000
+
+@app.route("/update_patients_bulk", methods=["POST"])
+def update_patients_bulk():
+    if not session.get("logged_in"):
+        return jsonify({"success": False, "error": "Not logged in"}), 401
+    patient_file = get_user_patient_file()
+    if not patient_file or not os.path.exists(patient_file):
+        return jsonify({"success": False, "error": "No patient file uploaded"}), 400
+
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    updates = data.get("patients") if isinstance(data, dict) else data
+    if not isinstance(updates, list):
+        return jsonify({"success": False, "error": "Expected a list of patients"}), 400
+    if len(updates) > MAX_BULK_ROWS:
+        return jsonify({"success": False, "error": f"At most {MAX_BULK_ROWS} patients per request"}), 413
+
+    results = [None] * len(updates)
+    valid = []
+    for i, update in enumerate(updates):
+        if not isinstance(update, dict) or patient_db.patient_id_of(update) is None:
+            results[i] = {"index": i, "success": False, "error": "Missing patient ID"}
+        elif not valid_version(update.get("_version")):
+            results[i] = {"index": i, "patient_id": patient_db.patient_id_of(update), "success": False,
+                          "error": "Invalid _version"}
+        else:
+            valid.append(i)
+
+    try:
+        applied = patient_db.update_rows(patient_file, [updates[i] for i in valid])
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+    changed = []
+    for i, result in zip(valid, applied):
+        patient_id = patient_db.patient_id_of(updates[i])
+        if "error" in result:
+            results[i] = {"index": i, "patient_id": patient_id, "success": False, "error": result["error"]}
+        elif not result["found"]:
+            results[i] = {"index": i, "patient_id": patient_id, "success": False, "error": "Patient not found"}
+        elif result["conflict"]:
+            results[i] = {"index": i, "patient_id": patient_id, "success": False,
+                          "error": "Patient was changed by someone else", "version": result["version"]}
+        else:
+            results[i] = {"index": i, "patient_id": patient_id, "success": True,
+                          "changed": bool(result["changes"]), "version": result["version"]}
+            if result["changes"]:
+                changed.append((patient_id, result["changes"]))
+
+    if changed:
+        # One audit entry for the whole batch.
+        details = " | ".join(
+            f"Patient ID {patient_id}: " + "; ".join(f"{field}: '{old}' → '{new}'" for field, old, new in changes)
+            for patient_id, changes in changed
+        )
+        add_log("BULK_EDIT", session["email"], f"{len(changed)} patients updated: {details}")
+        eligibility_cache.invalidate_patients(patient_id for patient_id, _ in changed)
+
+    elapsed = time.perf_counter() - started
+    succeeded = sum(1 for result in results if result["success"])
+    return jsonify({
+        "success": True,
+        "results": results,
+        "rows": len(updates),
+        "succeeded": succeeded,
+        "failed": len(updates) - succeeded,
+        "changed": len(changed),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "rows_per_second": round(len(valid) / elapsed) if elapsed else None,
+    })
+
 @app.route("/screen_patients", methods=["POST"])
 def screen_patients():
+    patient_file = get_user_patient_file()
+    if not patient_file or not os.path.exists(patient_file):
+        return jsonify({"success": False, "error": "No patient file uploaded"}), 400
+    data = request.get_json(silent=True) or {}
     try:
-        result = run_screening()
+        result = run_screening(patient_file, cancer_type=data.get("cancer_type") or None)
         return jsonify({"success": True, "result": result})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route("/screening_results/<screening_id>")
+def screening_results(screening_id):
+    screening = get_screening(screening_id)
+    if screening is None:
+        return jsonify({"success": False, "error": "Unknown or expired screening"}), 404
+    status = request.args.get("status", "eligible")
+    if status not in ("eligible", "ineligible"):
+        return jsonify({"success": False, "error": "status must be eligible or ineligible"}), 400
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), 500)
+    page = result_page(screening, request.args.get("trial_id", ""), status == "eligible", offset, limit)
+    if page is None:
+        return jsonify({"success": False, "error": "Trial not part of this screening"}), 404
+    return jsonify({"success": True, **page})
     
+@app.route("/patient/<patient_id>/trials")
+def patient_trials(patient_id):
+    patient_file = get_user_patient_file()
+    if not patient_file or not os.path.exists(patient_file):
+        return jsonify({"success": False, "error": "No patient file uploaded"}), 400
+    k = min(max(request.args.get("k", 10, type=int), 1), 100)
+    trials = match_index.trials_for_patient(patient_file, patient_id.strip(), k)
+    if trials is None:
+        return jsonify({"success": False, "error": "Patient not found"}), 404
+    return jsonify({"success": True, "patient_id": patient_id, "trials": trials})
+
+@app.route("/trial/<trial_id>/patients")
+def trial_patients(trial_id):
+    patient_file = get_user_patient_file()
+    if not patient_file or not os.path.exists(patient_file):
+        return jsonify({"success": False, "error": "No patient file uploaded"}), 400
+    offset = max(request.args.get("offset", 0, type=int), 0)
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), 500)
+    result = match_index.patients_for_trial(patient_file, trial_id, offset, limit)
+    if result is None:
+        return jsonify({"success": False, "error": "Trial not found"}), 404
+    return jsonify({"success": True, "trial_id": trial_id, "offset": offset, **result})
+
 @app.route("/upload_patients", methods=["GET", "POST"])
 def upload_patients():
     if not session.get("logged_in"):
@@ -455,10 +697,19 @@ def upload_patients():
         if file:
             email = session["email"].split("@")[0]
             filename = f"{email}_patients.csv"
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            file.save(file_path)
-            session["patient_file"] = file_path
-            add_log("UPLOAD", session["email"], f"Uploaded file {filename}")
+            db_path = os.path.join(UPLOAD_FOLDER, f"{email}_patients.sqlite")
+            wants_json = request.accept_mimetypes.best == "application/json"
+            try:
+                report = patient_db.import_upload(file.stream, db_path, MAX_UPLOAD_BYTES)
+            except patient_db.UploadTooLarge as e:
+                return (jsonify({"success": False, "error": str(e)}), 413) if wants_json else (str(e), 413)
+            except (ValueError, UnicodeDecodeError) as e:
+                return (jsonify({"success": False, "error": str(e)}), 400) if wants_json else (str(e), 400)
+            session["patient_file"] = db_path
+            add_log("UPLOAD", session["email"],
+                    f"Uploaded file {filename}: {report['imported']} rows imported, {report['rejected']} rejected")
+            if wants_json:
+                return jsonify({"success": True, **report})
             return redirect(url_for("home"))
 
     return render_template("upload_patients.html")
@@ -472,56 +723,50 @@ def download_patients():
     if not patient_file or not os.path.exists(patient_file):
         return "No patient file uploaded.", 400
 
-    filename = os.path.basename(patient_file)
+    filename = os.path.splitext(os.path.basename(patient_file))[0] + ".csv"
     add_log("DOWNLOAD", session["email"], f"Downloaded file {filename}")
-    return send_file(patient_file, as_attachment=True, download_name=filename)
+    return Response(
+        patient_db.iter_csv(patient_file),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 @app.route("/admin_logs")
 def admin_logs():
-    if session.get("email") not in ADMIN_EMAILS:
+    if not is_admin(session.get("email")):
         return jsonify({"error": "Unauthorized"}), 403
+    # Newest first, a page at a time: ?since=&until=&action=&email=&cursor=&limit=
+    return log_page(request.args.get("email", "").strip().lower() or None)
 
-    formatted_logs = []
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, encoding="utf-8") as f:
-            all_logs = json.load(f)
-        for user_logs in all_logs.values():
-            for log in user_logs:
-                formatted_logs.append({
-                    "action": log.get("action", ""),
-                    "timestamp": format_timestamp(log.get("timestamp", ""))
-                })
-    return jsonify({"logs": formatted_logs})
+@app.route("/admin_logs/daily")
+def admin_logs_daily():
+    if not is_admin(session.get("email")):
+        return jsonify({"error": "Unauthorized"}), 403
+    try:
+        filters = log_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"days": audit_log.daily_counts(**filters)})
+
+@app.route("/admin_logs/users")
+def admin_logs_users():
+    if not is_admin(session.get("email")):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({"users": audit_log.user_counts()})
 
 @app.route("/get_user_logs")
 def get_user_logs():
-    if session.get("email") not in ADMIN_EMAILS:
+    if not is_admin(session.get("email")):
         return jsonify({"error": "Unauthorized"}), 403
 
     target_email = request.args.get("email", "").strip().lower()
     if not target_email:
         return jsonify({"error": "Missing email"}), 400
-
-    logs = {}
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, encoding="utf-8") as f:
-            logs = json.load(f)
-
-    user_logs = logs.get(target_email, [])
-    formatted_logs = [
-        {
-            "action": log.get("action", ""),
-            "timestamp": format_timestamp(log.get("timestamp", "")),
-            "details": log.get("details", "")
-            
-        }
-        for log in user_logs
-    ]
-    return jsonify({"logs": formatted_logs})
+    return log_page(target_email)
 
 @app.route("/delete_user_log", methods=["POST"])
 def delete_user_log():
-    if session.get("email") not in ADMIN_EMAILS:
+    if not is_admin(session.get("email")):
         return jsonify({"success": False, "error": "Unauthorized"}), 403
 
     data = request.get_json()
@@ -531,24 +776,12 @@ def delete_user_log():
     if not target_email or not timestamp:
         return jsonify({"success": False, "error": "Missing data"}), 400
 
-    logs = {}
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, encoding="utf-8") as f:
-            logs = json.load(f)
-
-    user_logs = logs.get(target_email, [])
-    original_count = len(user_logs)
-    user_logs = [log for log in user_logs if log.get("timestamp") != timestamp]
-    logs[target_email] = user_logs
-
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        json.dump(logs, f, indent=2)
-
-    return jsonify({"success": True, "deleted": original_count - len(user_logs)})
+    deleted = audit_log.delete(target_email, timestamp)
+    return jsonify({"success": True, "deleted": deleted})
 
 @app.route("/delete_all_user_logs", methods=["POST"])
 def delete_all_user_logs():
-    if session.get("email") not in ADMIN_EMAILS:
+    if not is_admin(session.get("email")):
         return jsonify({"success": False, "error": "Unauthorized"}), 403
 
     data = request.get_json()
@@ -556,21 +789,39 @@ def delete_all_user_logs():
     if not target_email:
         return jsonify({"success": False, "error": "Missing email"}), 400
 
-    logs = {}
-    if os.path.exists(LOG_FILE):
-        with open(LOG_FILE, encoding="utf-8") as f:
-            logs = json.load(f)
-
-    deleted_count = len(logs.get(target_email, []))
-    if target_email in logs:
-        del logs[target_email]
-
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        json.dump(logs, f, indent=2)
-
+    deleted_count = audit_log.delete_user(target_email)
     return jsonify({"success": True, "deleted": deleted_count})
 
+@app.route("/metrics")
+def metrics_endpoint():
+    # Prometheus text format, for this worker process.
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def configure(app, config=None):
+    # Settings for this module's one app, applied before it serves (wsgi.py,
+    # the dev server, scripts). Not a factory: it updates app.config and
+    # replaces the module's audit_log and admins stores in place, so
+    # everything importing this module sees the change. All shared state is
+    # in SQLite or in files written under cross-process locks, so any number
+    # of worker processes can serve the same directory. config may set
+    # SECRET_KEY (which every worker must share), LOG_DIR, LOG_FSYNC,
+    # ADMIN_SECRETS_FILE and PROFILE_SLOW_MS / PROFILE_DIR (see
+    # metrics.instrument); SECRET_KEY and the PROFILE_ settings are also read
+    # from the environment.
+    global audit_log, admins
+    config = dict(config or {})
+    for name in ("SECRET_KEY", "PROFILE_SLOW_MS", "PROFILE_DIR"):
+        if os.environ.get(name) and name not in config:
+            config[name] = os.environ[name]
+    app.config.update(config)
+    if "LOG_DIR" in config or "LOG_FSYNC" in config:
+        audit_log = log_store.LogStore(config.get("LOG_DIR", LOG_DIR),
+                                       fsync=config.get("LOG_FSYNC", log_store.FSYNC_INTERVAL),
+                                       legacy_file=LOG_FILE)
+    if "ADMIN_SECRETS_FILE" in config:
+        admins = admin_store.AdminStore(config["ADMIN_SECRETS_FILE"])
+    return app
+
 if __name__ == "__main__":
+    configure(app)
     app.run(host='0.0.0.0', port=5000, debug=True)
-
-
@@ -0,0 +1,353 @@
+# catalogue.py
+
+import csv
+import hashlib
+import json
+import os
+import re
+import time
+import db
+import scraper
+
+CATALOGUE_DB = os.path.join("trials_data", "catalogue.sqlite")
+TRIALS_DIR = "trials_data"
+TRIALS_JSON = "trials.json"
+
+# A trial is one row keyed by NCT ID (or trials.json trial_id when it has none).
+# The same study can be listed for several countries and cancer types, which
+# live in trial_sites so "recruiting CLL trials in Romania" is an index lookup.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    trial_id TEXT PRIMARY KEY,
+    nct_id TEXT,
+    name TEXT NOT NULL,
+    link TEXT,
+    status TEXT NOT NULL,
+    eligibility TEXT,
+    inclusion TEXT,
+    exclusion TEXT,
+    exclusion_count REAL,
+    criteria TEXT,
+    source TEXT NOT NULL,
+    version TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trials_by_status ON trials (status);
+CREATE INDEX IF NOT EXISTS trials_by_nct ON trials (nct_id);
+CREATE TABLE IF NOT EXISTS trial_sites (
+    trial_id TEXT NOT NULL REFERENCES trials (trial_id) ON DELETE CASCADE,
+    country TEXT NOT NULL,
+    cancer_type TEXT NOT NULL,
+    PRIMARY KEY (trial_id, country, cancer_type)
+);
+CREATE INDEX IF NOT EXISTS sites_by_country_cancer ON trial_sites (country, cancer_type);
+CREATE INDEX IF NOT EXISTS sites_by_cancer ON trial_sites (cancer_type);
+
+-- Full-text index over the split eligibility text, kept in step with trials
+-- by triggers so every upsert from a scrape updates it incrementally.
+CREATE VIRTUAL TABLE IF NOT EXISTS trial_text USING fts5 (
+    name, inclusion, exclusion, content='trials', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS trials_text_insert AFTER INSERT ON trials BEGIN
+    INSERT INTO trial_text (rowid, name, inclusion, exclusion)
+    VALUES (new.rowid, new.name, new.inclusion, new.exclusion);
+END;
+CREATE TRIGGER IF NOT EXISTS trials_text_delete AFTER DELETE ON trials BEGIN
+    INSERT INTO trial_text (trial_text, rowid, name, inclusion, exclusion)
+    VALUES ('delete', old.rowid, old.name, old.inclusion, old.exclusion);
+END;
+CREATE TRIGGER IF NOT EXISTS trials_text_update AFTER UPDATE ON trials BEGIN
+    INSERT INTO trial_text (trial_text, rowid, name, inclusion, exclusion)
+    VALUES ('delete', old.rowid, old.name, old.inclusion, old.exclusion);
+    INSERT INTO trial_text (rowid, name, inclusion, exclusion)
+    VALUES (new.rowid, new.name, new.inclusion, new.exclusion);
+END;
+"""
+
+SEARCH_SECTIONS = ("inclusion", "exclusion")
+# bm25 column weights for (name, inclusion, exclusion).
+SEARCH_WEIGHTS = (2.0, 1.0, 1.0)
+
+TRIAL_COLUMNS = (
+    "trial_id", "nct_id", "name", "link", "status", "eligibility", "inclusion",
+    "exclusion", "exclusion_count", "criteria", "source", "version", "updated_at",
+)
+
+# PRAGMA user_version once trial_text has been built from every trial.
+# COUNT(*) on trial_text can't tell: it is external content, so it counts
+# the trials table itself.
+SEARCH_INDEX_VERSION = 1
+
+_indexed = set()
+
+def _connect():
+    conn = db.connect(CATALOGUE_DB, SCHEMA)
+    conn.execute("PRAGMA foreign_keys=ON")
+    if CATALOGUE_DB not in _indexed:
+        # Catalogues created before the search index existed get it built once.
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SEARCH_INDEX_VERSION:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                if conn.execute("PRAGMA user_version").fetchone()[0] < SEARCH_INDEX_VERSION:
+                    conn.execute("INSERT INTO trial_text (trial_text) VALUES ('rebuild')")
+                    conn.execute(f"PRAGMA user_version = {SEARCH_INDEX_VERSION}")
+        _indexed.add(CATALOGUE_DB)
+    return conn
+
+def normalize(value):
+    # Same folding as the trials_data/<country>/<cancer>/ directory names.
+    return (value or "").strip().lower().replace(" ", "_")
+
+def trial_version(trial):
+    # Changes whenever anything a screening result depends on changes.
+    payload = [trial.get("status"), trial.get("eligibility"), trial.get("criteria")]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def _trial_row(trial_id, name, link, status, eligibility, criteria=None, source="scrape", nct_id=None):
+    inclusion, exclusion = scraper.split_eligibility(eligibility)
+    trial = {
+        "trial_id": trial_id,
+        "nct_id": nct_id,
+        "name": name,
+        "link": link,
+        "status": (status or "RECRUITING").upper(),
+        "eligibility": eligibility,
+        "inclusion": inclusion,
+        "exclusion": exclusion,
+        "exclusion_count": scraper.count_exclusions(eligibility) if eligibility else None,
+        "criteria": json.dumps(criteria) if criteria else None,
+        "source": source,
+        "updated_at": time.time(),
+    }
+    trial["version"] = trial_version(trial)
+    return trial
+
+def _upsert(conn, trial, sites):
+    # Rows whose content is unchanged keep their version and updated_at.
+    existing = conn.execute("SELECT version FROM trials WHERE trial_id = ?", (trial["trial_id"],)).fetchone()
+    if existing is None or existing[0] != trial["version"]:
+        conn.execute(
+            f"INSERT INTO trials ({', '.join(TRIAL_COLUMNS)}) VALUES ({', '.join('?' * len(TRIAL_COLUMNS))}) "
+            f"ON CONFLICT (trial_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in TRIAL_COLUMNS[1:])}",
+            [trial[c] for c in TRIAL_COLUMNS],
+        )
+    conn.executemany(
+        "INSERT OR IGNORE INTO trial_sites (trial_id, country, cancer_type) VALUES (?, ?, ?)",
+        [(trial["trial_id"], normalize(country), normalize(cancer_type)) for country, cancer_type in sites],
+    )
+    return existing is None or existing[0] != trial["version"]
+
+def record_scrape(country, cancer_type, records):
+    # Makes the catalogue's view of (country, cancer_type) match a scrape result.
+    # Trials that dropped out lose that site, and are removed once they have none.
+    country, cancer_type = normalize(country), normalize(cancer_type)
+    conn = _connect()
+    changed = []
+    with conn:
+        live = set()
+        for record in records:
+            trial_id = record["nct_id"] or scraper.sanitize_filename(record["name"])
+            trial = _trial_row(trial_id, record["name"], record["link"], record["status"], record["eligibility"],
+                               nct_id=record["nct_id"])
+            if _upsert(conn, trial, [(country, cancer_type)]):
+                changed.append(trial_id)
+            live.add(trial_id)
+        stale = [
+            (trial_id, country, cancer_type)
+            for (trial_id,) in conn.execute(
+                "SELECT trial_id FROM trial_sites WHERE country = ? AND cancer_type = ?", (country, cancer_type)
+            )
+            if trial_id not in live
+        ]
+        conn.executemany("DELETE FROM trial_sites WHERE trial_id = ? AND country = ? AND cancer_type = ?", stale)
+        conn.execute(
+            "DELETE FROM trials WHERE source = 'scrape' AND trial_id NOT IN (SELECT trial_id FROM trial_sites)"
+        )
+    return {"changed": changed, "removed": [trial_id for trial_id, _, _ in stale]}
+
+def read_trial_csv(path):
+    fields = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.reader(f):
+            if len(row) > 1 and row[0].endswith(":"):
+                fields.setdefault(row[0][:-1], row[1])
+    return fields
+
+def import_csv_tree(root=TRIALS_DIR):
+    # Everything under trials_data/ came from a recruiting / not-yet-recruiting
+    # listing, so that is the status unless the directory manifest says otherwise.
+    imported = 0
+    conn = _connect()
+    with conn:
+        for country in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            country_dir = os.path.join(root, country)
+            if country.startswith(".") or not os.path.isdir(country_dir):
+                continue
+            for cancer_type in sorted(os.listdir(country_dir)):
+                cancer_dir = os.path.join(country_dir, cancer_type)
+                if not os.path.isdir(cancer_dir):
+                    continue
+                statuses = {
+                    entry["filename"]: entry.get("status")
+                    for entry in scraper.load_manifest(cancer_dir).values()
+                }
+                for filename in sorted(os.listdir(cancer_dir)):
+                    if not filename.endswith(".csv"):
+                        continue
+                    fields = read_trial_csv(os.path.join(cancer_dir, filename))
+                    link = fields.get("More Detailed Information", "n/a")
+                    eligibility = fields.get("Eligibility Criteria", "")
+                    # EU files repeat the label inside the cell.
+                    if eligibility.startswith("Eligibility Criteria: "):
+                        eligibility = eligibility[len("Eligibility Criteria: "):]
+                    nct_id = scraper.extract_nct_id_from_url(link) if link != "n/a" else None
+                    trial = _trial_row(
+                        nct_id or filename[:-4],
+                        fields.get("Name", "Unnamed Trial"),
+                        link,
+                        statuses.get(filename),
+                        eligibility,
+                        nct_id=nct_id,
+                    )
+                    _upsert(conn, trial, [(country, cancer_type)])
+                    imported += 1
+    return imported
+
+def import_trials_json(path=TRIALS_JSON):
+    # Hand-curated trials with structured screener criteria. They are not tied
+    # to a country, so their site has an empty country.
+    with open(path, encoding="utf-8") as f:
+        trials = json.load(f)
+    conn = _connect()
+    with conn:
+        for item in trials:
+            criteria = {
+                "inclusion_criteria": item.get("inclusion_criteria", {}),
+                "exclusion_criteria": item.get("exclusion_criteria", {}),
+            }
+            nct_id = item.get("nct_id")
+            trial = _trial_row(
+                item["trial_id"], item.get("name", item["trial_id"]),
+                f"https://clinicaltrials.gov/study/{nct_id}" if nct_id else "#",
+                item.get("status"), item.get("eligibility", ""), criteria=criteria, source="trials.json",
+                nct_id=nct_id,
+            )
+            _upsert(conn, trial, [("", item.get("cancer_type", ""))])
+    return len(trials)
+
+def import_all(root=TRIALS_DIR, trials_json=TRIALS_JSON):
+    counts = {"csv": import_csv_tree(root), "json": 0}
+    if os.path.exists(trials_json):
+        counts["json"] = import_trials_json(trials_json)
+    return counts
+
+def _row_to_trial(row):
+    trial = dict(zip(TRIAL_COLUMNS, row))
+    trial["criteria"] = json.loads(trial["criteria"]) if trial["criteria"] else None
+    return trial
+
+def find_trials(country=None, cancer_type=None, status=None, structured_only=False):
+    sql = [f"SELECT DISTINCT {', '.join('t.' + c for c in TRIAL_COLUMNS)} FROM trials t"]
+    where, args = [], []
+    if country is not None or cancer_type is not None:
+        sql.append("JOIN trial_sites s ON s.trial_id = t.trial_id")
+    if country is not None:
+        where.append("s.country = ?")
+        args.append(normalize(country))
+    if cancer_type is not None:
+        where.append("s.cancer_type = ?")
+        args.append(normalize(cancer_type))
+    if status is not None:
+        where.append("t.status = ?")
+        args.append(status.upper())
+    if structured_only:
+        where.append("t.criteria IS NOT NULL")
+    if where:
+        sql.append("WHERE " + " AND ".join(where))
+    sql.append("ORDER BY t.exclusion_count, t.trial_id")
+    return [_row_to_trial(row) for row in _connect().execute(" ".join(sql), args)]
+
+def get_trial(trial_id):
+    row = _connect().execute(
+        f"SELECT {', '.join(TRIAL_COLUMNS)} FROM trials WHERE trial_id = ?", (trial_id,)
+    ).fetchone()
+    return _row_to_trial(row) if row else None
+
+def trial_sites(trial_id):
+    return [
+        {"country": country, "cancer_type": cancer_type}
+        for country, cancer_type in _connect().execute(
+            "SELECT country, cancer_type FROM trial_sites WHERE trial_id = ?", (trial_id,)
+        )
+    ]
+
+def sites_by_trial():
+    sites = {}
+    for trial_id, country, cancer_type in _connect().execute("SELECT trial_id, country, cancer_type FROM trial_sites"):
+        sites.setdefault(trial_id, []).append((country, cancer_type))
+    return sites
+
+def catalogue_stamp():
+    # Changes whenever a trial or a site is added, changed or removed.
+    return _connect().execute(
+        "SELECT COUNT(*), COALESCE(MAX(updated_at), 0), (SELECT COUNT(*) FROM trial_sites) FROM trials"
+    ).fetchone()
+
+def to_match_query(query):
+    # "quoted phrases" stay phrases; every other word is quoted on its own so
+    # things like HER2-negative or ECOG are never read as FTS5 operators.
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query or ""):
+        text = (phrase or word).strip()
+        if text:
+            terms.append('"' + text.replace('"', '""') + '"')
+    return " AND ".join(terms)
+
+def search(query, section=None, country=None, cancer_type=None, status=None, limit=20, offset=0):
+    match = to_match_query(query)
+    if not match:
+        return []
+    if section:
+        if section not in SEARCH_SECTIONS:
+            raise ValueError(f"Unknown section: {section}")
+        match = f"{{{section}}} : ({match})"
+
+    where, args = ["trial_text MATCH ?"], [match]
+    if country is not None or cancer_type is not None:
+        site = ["s.trial_id = t.trial_id"]
+        if country is not None:
+            site.append("s.country = ?")
+            args.append(normalize(country))
+        if cancer_type is not None:
+            site.append("s.cancer_type = ?")
+            args.append(normalize(cancer_type))
+        where.append(f"EXISTS (SELECT 1 FROM trial_sites s WHERE {' AND '.join(site)})")
+    if status is not None:
+        where.append("t.status = ?")
+        args.append(status.upper())
+
+    sql = f"""
+        SELECT t.trial_id, t.name, t.link, t.status, t.exclusion_count,
+               bm25(trial_text, {', '.join(map(str, SEARCH_WEIGHTS))}) AS score,
+               snippet(trial_text, -1, '<mark>', '</mark>', '…', 16)
+        FROM trial_text JOIN trials t ON t.rowid = trial_text.rowid
+        WHERE {' AND '.join(where)}
+        ORDER BY score
+        LIMIT ? OFFSET ?
+    """
+    return [
+        {
+            "trial_id": trial_id,
+            "name": name,
+            "link": link,
+            "status": status,
+            "exclusion_count": exclusion_count,
+            "score": round(-score, 4),
+            "snippet": snippet,
+        }
+        for trial_id, name, link, status, exclusion_count, score, snippet
+        in _connect().execute(sql, args + [limit, offset])
+    ]
+
+if __name__ == "__main__":
+    print(import_all())
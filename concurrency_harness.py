@@ -0,0 +1,146 @@
+# concurrency_harness.py
+#
+# Hammers the shared-state write paths from many processes at once and checks
+# that nothing was lost:
+#
+#   python concurrency_harness.py --processes 8 --iterations 50
+#
+# Each worker process imports the app on its own, as a WSGI worker would, in
+# a scratch directory holding a fresh patient database, admin file and log.
+# Per iteration it saves a different patient through /update_patient, adds an
+# admin through /add_admin and writes an audit entry with add_log. Afterwards
+# every edit, admin and log entry must be there. Exits 1 if any is missing.
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+ADMIN = "harness@hse.ie"
+
+def _setup(directory, rows):
+    sys.path.insert(0, REPO)
+    import patient_creation_4
+    import patient_db
+    os.chdir(directory)
+    patient_creation_4.generate_patients(rows, "patients.csv")
+    with open("patients.csv", newline="", encoding="utf-8") as f:
+        ids = [row["Patient ID"] for row in csv.DictReader(f)]
+    db_path = patient_db.import_csv("patients.csv", os.path.join("uploads", "harness_patients.sqlite"))
+    with open("admin_secrets.json", "w", encoding="utf-8") as f:
+        json.dump({ADMIN: {"secret": "A" * 32, "qr_shown": True, "permissions": ["add_admin"]}}, f)
+    return ids, db_path
+
+def _worker(directory, worker, patient_ids, db_path, iterations, start, failures):
+    try:
+        os.chdir(directory)
+        sys.path.insert(0, REPO)
+        import app as webapp
+        client = webapp.configure(webapp.app, {"TESTING": True}).test_client()
+        with client.session_transaction() as session:
+            session.update({"logged_in": True, "email": ADMIN, "patient_file": db_path})
+    except BaseException:
+        start.abort()  # release everyone else rather than leave them waiting
+        raise
+    start.wait(timeout=300)
+    for i in range(iterations):
+        patient_id = patient_ids[worker * iterations + i]
+        response = client.post("/update_patient", json={"Patient ID": patient_id, "Patient name": f"w{worker}-i{i}"})
+        if response.status_code != 200:
+            failures.put(f"/update_patient {patient_id}: {response.status_code} {response.get_data(as_text=True)}")
+        response = client.post("/add_admin", json={"email": f"w{worker}-i{i}@hse.ie"})
+        if not (response.get_json() or {}).get("success"):
+            failures.put(f"/add_admin w{worker}-i{i}: {response.get_data(as_text=True)}")
+        webapp.add_log("HARNESS", f"w{worker}@hse.ie", f"w{worker}-i{i}")
+
+def _check(directory, patient_ids, db_path, processes, iterations):
+    import patient_db
+    import log_store
+    os.chdir(directory)
+    expected = {f"w{w}-i{i}" for w in range(processes) for i in range(iterations)}
+    problems = []
+
+    header, rows, _, _, _ = patient_db.read_all(db_path)
+    names = {row[header.index("Patient ID")]: row[header.index("Patient name")] for row in rows}
+    edited = {names[patient_ids[w * iterations + i]] for w in range(processes) for i in range(iterations)}
+    if edited != expected:
+        problems.append(f"patient edits: {len(expected - edited)} of {len(expected)} lost")
+
+    with open("admin_secrets.json", encoding="utf-8") as f:
+        admins = {email.split("@")[0] for email in json.load(f)}
+    if not expected <= admins:
+        problems.append(f"admins: {len(expected - admins)} of {len(expected)} lost")
+
+    entries = log_store.LogStore("logs").entries()
+    logged = [entry["details"] for entry in entries if entry["action"] == "HARNESS"]
+    if set(logged) != expected or len(logged) != len(expected):
+        problems.append(f"add_log: {len(logged)} entries for {len(expected)} calls")
+    edits = sum(1 for entry in entries if entry["action"] == "EDIT")
+    if edits != len(expected):
+        problems.append(f"EDIT log: {edits} entries for {len(expected)} saves")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that concurrent writers lose nothing.")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="harness-")
+    cwd = os.getcwd()
+    try:
+        needed = args.processes * args.iterations
+        patient_ids, db_path = _setup(directory, max(needed * 2, 1000))
+        if len(patient_ids) < needed:
+            sys.exit(f"Only {len(patient_ids)} patients generated, need {needed}")
+
+        context = multiprocessing.get_context("spawn")
+        start = context.Barrier(args.processes + 1)  # everyone starts writing together
+        failures = context.Queue()
+        workers = [
+            context.Process(target=_worker,
+                            args=(directory, w, patient_ids, db_path, args.iterations, start, failures))
+            for w in range(args.processes)
+        ]
+        for process in workers:
+            process.start()
+        try:
+            start.wait(timeout=300)
+        except threading.BrokenBarrierError:
+            for process in workers:
+                process.join()
+            print("FAIL a worker could not start; see its traceback above")
+            return 1
+        began = time.perf_counter()
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - began
+
+        problems = []
+        while not failures.empty():
+            problems.append(failures.get())
+        problems += [f"worker exited with {p.exitcode}" for p in workers if p.exitcode]
+        problems += _check(directory, patient_ids, db_path, args.processes, args.iterations)
+        print(f"{args.processes} processes x {args.iterations} iterations: {needed * 3} writes "
+              f"in {elapsed:.2f}s ({needed * 3 / elapsed:.0f}/s)")
+        for problem in problems:
+            print(f"FAIL {problem}")
+        print("OK" if not problems else f"{len(problems)} problems")
+        return 1 if problems else 0
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Scratch directory kept at {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
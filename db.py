@@ -0,0 +1,33 @@
+# db.py
+
+import os
+import sqlite3
+import threading
+
+_local = threading.local()
+
+def connect(path, schema=""):
+    # One connection per thread per database file, created on first use. A
+    # forked worker process starts over rather than use its parent's.
+    conns = getattr(_local, "conns", None)
+    if conns is None or _local.pid != os.getpid():
+        conns = _local.conns = {}
+        _local.pid = os.getpid()
+    conn = conns.get(path)
+    if conn is None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if schema:
+            conn.executescript(schema)
+        conns[path] = conn
+    return conn
+
+def close(path):
+    conns = getattr(_local, "conns", {})
+    conn = conns.pop(path, None)
+    if conn is not None:
+        conn.close()
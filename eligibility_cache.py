@@ -0,0 +1,71 @@
+# eligibility_cache.py
+
+import threading
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+MAX_CELLS_PER_TRIAL = 1_000_000  # a trial's cells are dropped wholesale past this
+
+# trial_id -> (trial version, failure masks indexed by (patient_id, row_hash))
+_cells = {}
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "invalidated": 0}
+
+def row_keys(features):
+    return pd.MultiIndex.from_arrays([features["patient_id"], features["row_hash"]],
+                                     names=["patient_id", "row_hash"])
+
+def lookup(keys, trials):
+    # Cached failure masks shaped (patients, trials), MISSING where not cached.
+    result = np.full((len(keys), len(trials)), MISSING, dtype=np.int32)
+    with _lock:
+        for j, trial in enumerate(trials):
+            entry = _cells.get(trial["trial_id"])
+            if entry is None or entry[0] != trial["version"]:
+                continue
+            result[:, j] = entry[1].reindex(keys, fill_value=MISSING).to_numpy()
+        missing = int((result == MISSING).sum())
+        _stats["misses"] += missing
+        _stats["hits"] += result.size - missing
+    return result
+
+def store(keys, trials, failures):
+    with _lock:
+        for j, trial in enumerate(trials):
+            fresh = pd.Series(failures[:, j].astype(np.int32), index=keys)
+            entry = _cells.get(trial["trial_id"])
+            if entry is not None and entry[0] == trial["version"] and len(entry[1]) + len(fresh) <= MAX_CELLS_PER_TRIAL:
+                fresh = pd.concat([entry[1], fresh])
+            _cells[trial["trial_id"]] = (trial["version"], fresh[~fresh.index.duplicated(keep="last")])
+
+def invalidate_patient(patient_id):
+    invalidate_patients([patient_id])
+
+def invalidate_patients(patient_ids):
+    # Drops every cached cell for these patients, whatever row version it was
+    # for, in one pass over each trial's cells.
+    patient_ids = list(patient_ids)
+    if not patient_ids:
+        return
+    with _lock:
+        for trial_id, (version, cells) in list(_cells.items()):
+            stale = cells.index.get_level_values("patient_id").isin(patient_ids)
+            if stale.any():
+                _stats["invalidated"] += int(stale.sum())
+                _cells[trial_id] = (version, cells[~stale])
+
+def invalidate_trials(trial_ids):
+    with _lock:
+        for trial_id in trial_ids:
+            entry = _cells.pop(trial_id, None)
+            if entry is not None:
+                _stats["invalidated"] += len(entry[1])
+
+def clear():
+    with _lock:
+        _cells.clear()
+
+def cache_stats():
+    with _lock:
+        return {**_stats, "trials": len(_cells), "cells": sum(len(cells) for _, cells in _cells.values())}
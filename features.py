@@ -0,0 +1,215 @@
+# features.py
+
+import datetime
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import patient_db
+from patient_creation_4 import MUTATIONS, TREATMENTS
+
+MAX_CACHED_FILES = 8
+
+# One bit per known mutation / treatment, in the order patient_creation_4 lists them.
+MUTATION_BITS = {name: 1 << i for i, name in enumerate(m for m in MUTATIONS if m != "None")}
+TREATMENT_BITS = {name: 1 << i for i, name in enumerate(t for t in TREATMENTS if t != "None")}
+
+# (T stages, N stages, M stages) -> stage group, first match wins. None matches anything.
+STAGE_GROUPS = [
+    (None, None, {"M1"}, "Stage IV"),
+    (None, {"N2", "N3"}, None, "Stage III"),
+    ({"T4"}, None, None, "Stage III"),
+    ({"T3"}, {"N1"}, None, "Stage III"),
+    ({"T3"}, None, None, "Stage II"),
+    (None, {"N1"}, None, "Stage II"),
+    ({"T2"}, None, None, "Stage II"),
+    ({"T1"}, None, None, "Stage I"),
+    ({"T0"}, {"N0"}, None, "Stage 0"),
+]
+
+def split_list(value):
+    # "BRAF, EGFR" -> ["BRAF", "EGFR"]; "None" and "" -> []
+    return [part.strip() for part in value.split(",") if part.strip() and part.strip() != "None"]
+
+def stage_group(t, n, m):
+    for t_set, n_set, m_set, group in STAGE_GROUPS:
+        if (t_set is None or t in t_set) and (n_set is None or n in n_set) and (m_set is None or m in m_set):
+            return group
+    return ""
+
+def treatments_of(previous, more_than_one):
+    # generate_patients puts a single treatment in "Previous treatment" and a
+    # comma-joined list in "More than 1 treatment" (with a pointer in the former).
+    return split_list(more_than_one if more_than_one not in ("", "No") else previous)
+
+def to_bits(names, bits):
+    mask = 0
+    for name in names:
+        mask |= bits.get(name, 0)
+    return mask
+
+def _per_value(column, parse, dtype=object):
+    # Parses each distinct string once and spreads the result over the rows.
+    codes, uniques = pd.factorize(column)
+    parsed = np.array([parse(v) for v in uniques], dtype=dtype)
+    return parsed[codes] if len(uniques) else np.empty(0, dtype=dtype)
+
+def _per_row(raw, columns, parse, dtype=object):
+    # Same as _per_value, for features derived from several columns.
+    keys = raw[columns[0]]
+    for column in columns[1:]:
+        keys = keys + "\x1f" + raw[column]
+    return _per_value(keys, lambda key: parse(*key.split("\x1f")), dtype)
+
+def _text(raw, column):
+    return raw[column].str.strip()
+
+def _category(raw, column):
+    return raw[column].str.strip().astype("category")
+
+def _number(raw, column):
+    return pd.to_numeric(raw[column], errors="coerce")
+
+def _age(raw):
+    return datetime.date.today().year - _number(raw, "Year of birth")
+
+def _stage(raw):
+    groups = _per_row(raw, ("T stage", "N stage", "M stage"), stage_group)
+    return pd.Categorical(groups)
+
+def _measurable(raw):
+    return ((raw["T stage"] != "T0") | (raw["N stage"] != "N0") | (raw["M stage"] == "M1")).to_numpy()
+
+def _treatment_history(raw):
+    return _per_row(raw, ("Previous treatment", "More than 1 treatment"),
+                    lambda p, m: ", ".join(treatments_of(p, m)) or "None")
+
+def _prior_lines(raw):
+    return _per_row(raw, ("Previous treatment", "More than 1 treatment"),
+                    lambda p, m: len(treatments_of(p, m)), dtype=np.int8)
+
+def _treatment_bits(raw):
+    return _per_row(raw, ("Previous treatment", "More than 1 treatment"),
+                    lambda p, m: to_bits(treatments_of(p, m), TREATMENT_BITS), dtype=np.uint8)
+
+def _row_hash(raw):
+    # Changes whenever any column of the row changes; keys the eligibility cache.
+    return pd.util.hash_pandas_object(raw, index=False).to_numpy()
+
+def _mutation_bits(raw):
+    return _per_value(raw["Mutations detected"], lambda v: to_bits(split_list(v), MUTATION_BITS), dtype=np.uint8)
+
+# Feature name -> how it is built from the raw CSV columns.
+FEATURES = {
+    "patient_id": lambda raw: _text(raw, "Patient ID"),
+    "name": lambda raw: _text(raw, "Patient name"),
+    "cancer": lambda raw: _category(raw, "Cancer type"),
+    "country": lambda raw: _category(raw, "Country"),
+    "age": _age,
+    "ecog": lambda raw: _number(raw, "ECOG"),
+    "diagnosis": lambda raw: _category(raw, "Diagnosis type"),
+    "stage": _stage,
+    "treatment_history": _treatment_history,
+    "prior_lines": _prior_lines,
+    "measurable_disease": _measurable,
+    "comorbidities": lambda raw: _category(raw, "Patient status on referral"),
+    "mutations": _mutation_bits,
+    "treatments": _treatment_bits,
+    "row_hash": _row_hash,
+}
+
+def compile_features(raw):
+    # raw holds the CSV as strings (dtype=str, keep_default_na=False).
+    return pd.DataFrame({name: build(raw) for name, build in FEATURES.items()}, index=raw.index)
+
+def has_mutation(features, name):
+    return (features["mutations"].to_numpy() & MUTATION_BITS[name]) != 0
+
+def had_treatment(features, name):
+    return (features["treatments"].to_numpy() & TREATMENT_BITS[name]) != 0
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+_cache = OrderedDict()       # content hash -> feature table
+_hashes = {}                 # (path, mtime, size) -> content hash
+_lock = threading.Lock()
+
+def _content_hash(path):
+    stat = os.stat(path)
+    stamp = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    digest = _hashes.get(stamp)
+    if digest is None:
+        if len(_hashes) > 1024:
+            _hashes.clear()
+        digest = _hashes[stamp] = file_hash(path)
+    return digest
+
+def patch_features(features, raw_rows, positions):
+    # Copy of features with the given rows recompiled from raw_rows.
+    fresh = compile_features(raw_rows)
+    patched = features.copy()
+    for name in FEATURES:
+        values = fresh[name]
+        if isinstance(patched[name].dtype, pd.CategoricalDtype):
+            extra = [v for v in values.unique() if v not in patched[name].cat.categories]
+            if extra:
+                patched[name] = patched[name].cat.add_categories(extra)
+            values = values.astype(object)
+        patched.iloc[positions, patched.columns.get_loc(name)] = values.to_numpy()
+    return patched
+
+_db_cache = {}  # patient db path -> (generation, version, raw, features)
+
+def _load_db_features(path):
+    # Patient databases are compiled once per import; row updates since are
+    # recompiled on their own and patched in.
+    path = os.path.abspath(path)
+    generation, version = patient_db.stamp(path)
+    with _lock:
+        entry = _db_cache.get(path)
+    if entry is not None and entry[0] == generation and entry[1] == version:
+        features = entry[3]
+    elif entry is not None and entry[0] == generation:
+        changes = patient_db.changes_since(path, entry[1])
+        raw = entry[2]  # private to this cache, so patched in place
+        positions = [row_no for row_no, _, _ in changes]
+        width = len(raw.columns)
+        rows = pd.DataFrame([patient_db.pad(row, width) for _, row, _ in changes], columns=raw.columns, dtype=object)
+        raw.iloc[positions] = rows.to_numpy()
+        version = max([version] + [row_version for _, _, row_version in changes])
+        features = patch_features(entry[3], rows, positions)
+        entry = (generation, version, raw, features)
+    else:
+        header, rows, _, generation, version = patient_db.read_all(path)
+        raw = pd.DataFrame([patient_db.pad(row, len(header)) for row in rows], columns=header, dtype=object)
+        features = compile_features(raw)
+        entry = (generation, version, raw, features)
+    with _lock:
+        _db_cache[path] = entry
+    return features, f"{path}@{generation}.{version}"
+
+def load_features(path):
+    # Returns (features, key), where key changes whenever the contents do.
+    # A CSV is parsed once per distinct file content (key: its SHA-256).
+    if patient_db.is_patient_db(path):
+        return _load_db_features(path)
+    digest = _content_hash(path)
+    with _lock:
+        features = _cache.get(digest)
+        if features is not None:
+            _cache.move_to_end(digest)
+            return features, digest
+    raw = pd.read_csv(path, dtype=str, keep_default_na=False)
+    features = compile_features(raw)
+    with _lock:
+        _cache[digest] = features
+        while len(_cache) > MAX_CACHED_FILES:
+            _cache.popitem(last=False)
+    return features, digest
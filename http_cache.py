@@ -0,0 +1,177 @@
+# http_cache.py
+
+import json
+import os
+import time
+import requests
+import db
+from requests.structures import CaseInsensitiveDict
+
+CACHE_DIR = os.path.join("trials_data", ".cache")
+CACHE_DB = os.path.join(CACHE_DIR, "http_cache.sqlite")
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+
+# How long a response stays fresh before it has to be revalidated, per URL class.
+CACHE_TTLS = {
+    "listing": 6 * 3600,      # cancertrials.ie listing pages
+    "trial_page": 24 * 3600,  # cancertrials.ie trial pages
+    "study": 24 * 3600,       # clinicaltrials.gov /api/v2/studies/{nct_id}
+    "search": 6 * 3600,       # clinicaltrials.gov /api/v2/studies?query...
+}
+
+# Only headers that are still true for the stored (decoded) body are kept.
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Date")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    url_class TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS stats (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def _connect():
+    return db.connect(CACHE_DB, SCHEMA)
+
+def _bump(conn, name):
+    conn.execute(
+        "INSERT INTO stats (name, value) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET value = value + 1",
+        (name,),
+    )
+
+def cache_key(url, params=None):
+    return requests.Request("GET", url, params=params).prepare().url
+
+def is_fresh(entry, now=None):
+    ttl = CACHE_TTLS.get(entry["url_class"], 0)
+    return (now or time.time()) - entry["fetched_at"] < ttl
+
+def lookup(key):
+    conn = _connect()
+    row = conn.execute(
+        "SELECT url_class, status, headers, body, etag, last_modified, fetched_at FROM entries WHERE key = ?",
+        (key,),
+    ).fetchone()
+    if row is None:
+        return None
+    with conn:
+        conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+    return {
+        "key": key,
+        "url_class": row[0],
+        "status": row[1],
+        "headers": json.loads(row[2]),
+        "body": row[3],
+        "etag": row[4],
+        "last_modified": row[5],
+        "fetched_at": row[6],
+    }
+
+def conditional_headers(entry):
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+def store(key, url_class, response):
+    headers = {h: response.headers[h] for h in KEPT_HEADERS if h in response.headers}
+    body = response.content
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, url_class, response.status_code, json.dumps(headers), body,
+             headers.get("ETag"), headers.get("Last-Modified"), now, now, len(body)),
+        )
+    _evict(conn)
+
+def refresh(key):
+    now = time.time()
+    conn = _connect()
+    with conn:
+        conn.execute("UPDATE entries SET fetched_at = ?, accessed_at = ? WHERE key = ?", (now, now, key))
+
+def _evict(conn):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    if total <= MAX_CACHE_BYTES:
+        return
+    # Drop least recently used entries until we are back under 90% of the cap.
+    target = total - int(MAX_CACHE_BYTES * 0.9)
+    freed = 0
+    doomed = []
+    for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed_at"):
+        doomed.append((key,))
+        freed += size
+        if freed >= target:
+            break
+    with conn:
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+        conn.execute(
+            "INSERT INTO stats (name, value) VALUES ('evicted', ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (len(doomed), len(doomed)),
+        )
+
+def record(outcome):
+    conn = _connect()
+    with conn:
+        _bump(conn, outcome)
+
+def to_response(entry, url):
+    response = requests.Response()
+    response.status_code = entry["status"]
+    response.reason = "OK"
+    response._content = entry["body"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response.url = url
+    response.from_cache = True
+    return response
+
+def cache_stats():
+    conn = _connect()
+    counters = dict(conn.execute("SELECT name, value FROM stats"))
+    by_class = {
+        url_class: {"entries": count, "bytes": size}
+        for url_class, count, size in conn.execute(
+            "SELECT url_class, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY url_class"
+        )
+    }
+    hits = counters.get("hit", 0) + counters.get("revalidated", 0)
+    lookups = hits + counters.get("miss", 0)
+    return {
+        "hits": counters.get("hit", 0),
+        "revalidated": counters.get("revalidated", 0),
+        "misses": counters.get("miss", 0),
+        "evicted": counters.get("evicted", 0),
+        "hit_ratio": round(hits / lookups, 3) if lookups else None,
+        "entries": sum(c["entries"] for c in by_class.values()),
+        "bytes": sum(c["bytes"] for c in by_class.values()),
+        "max_bytes": MAX_CACHE_BYTES,
+        "by_class": by_class,
+    }
+
+def purge(url_class=None):
+    conn = _connect()
+    with conn:
+        if url_class:
+            deleted = conn.execute("DELETE FROM entries WHERE url_class = ?", (url_class,)).rowcount
+        else:
+            deleted = conn.execute("DELETE FROM entries").rowcount
+            conn.execute("DELETE FROM stats")
+    conn.execute("VACUUM")
+    return deleted
@@ -0,0 +1,136 @@
+# http_client.py
+
+import threading
+from contextlib import contextmanager
+import requests
+import http_cache
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout applied when a caller does not pass one.
+DEFAULT_TIMEOUT = (5, 20)
+
+# Keep-alive pool size per host. Anything not listed gets DEFAULT_POOL_SIZE.
+DEFAULT_POOL_SIZE = 4
+HOST_POOL_SIZES = {
+    "https://www.cancertrials.ie/": 4,
+    "https://clinicaltrials.gov/": 8,
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 4
+BACKOFF_FACTOR = 0.5  # 0.5s, 1s, 2s, 4s between attempts
+
+# Process-wide counts, plus the counts of whatever a thread is tracking (see
+# track), so concurrent scrapes each report only their own connections.
+_stats = {"opened": 0, "checkouts": 0}
+_stats_lock = threading.Lock()
+_local = threading.local()
+
+def _count(key):
+    tracked = getattr(_local, "stats", None)
+    with _stats_lock:
+        _stats[key] += 1
+        if tracked is not None:
+            tracked[key] += 1
+
+def new_stats():
+    return {"opened": 0, "checkouts": 0}
+
+@contextmanager
+def track(stats):
+    # Counts this thread's requests into `stats` (from new_stats) as well.
+    previous = getattr(_local, "stats", None)
+    _local.stats = stats
+    try:
+        yield stats
+    finally:
+        _local.stats = previous
+
+class _CountingPoolMixin:
+    def _new_conn(self):
+        _count("opened")
+        return super()._new_conn()
+
+    def _get_conn(self, timeout=None):
+        _count("checkouts")
+        return super()._get_conn(timeout)
+
+class CountingHTTPConnectionPool(_CountingPoolMixin, HTTPConnectionPool):
+    pass
+
+class CountingHTTPSConnectionPool(_CountingPoolMixin, HTTPSConnectionPool):
+    pass
+
+class PooledAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": CountingHTTPConnectionPool,
+            "https": CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        return super().send(request, timeout=timeout, **kwargs)
+
+def make_retry():
+    # raise_on_status=False hands the last 429/5xx back to the caller so
+    # raise_for_status() behaves the same as with a bare requests.get.
+    return Retry(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+def build_session():
+    session = requests.Session()
+    default = PooledAdapter(pool_connections=len(HOST_POOL_SIZES) + 4, pool_maxsize=DEFAULT_POOL_SIZE, max_retries=make_retry())
+    session.mount("http://", default)
+    session.mount("https://", default)
+    for prefix, size in HOST_POOL_SIZES.items():
+        session.mount(prefix, PooledAdapter(pool_connections=1, pool_maxsize=size, max_retries=make_retry()))
+    return session
+
+SESSION = build_session()
+
+# Set to False to always go to the network.
+CACHE_ENABLED = True
+
+def get(url, url_class=None, params=None, **kwargs):
+    # Only requests tagged with a url_class (see http_cache.CACHE_TTLS) are cached.
+    if not CACHE_ENABLED or url_class not in http_cache.CACHE_TTLS:
+        return SESSION.get(url, params=params, **kwargs)
+
+    key = http_cache.cache_key(url, params)
+    entry = http_cache.lookup(key)
+    if entry and http_cache.is_fresh(entry):
+        http_cache.record("hit")
+        return http_cache.to_response(entry, key)
+
+    headers = dict(kwargs.pop("headers", None) or {})
+    if entry:
+        headers.update(http_cache.conditional_headers(entry))
+    response = SESSION.get(url, params=params, headers=headers, **kwargs)
+
+    if entry and response.status_code == 304:
+        http_cache.refresh(key)
+        http_cache.record("revalidated")
+        return http_cache.to_response(entry, key)
+
+    http_cache.record("miss")
+    if response.status_code == 200:
+        http_cache.store(key, url_class, response)
+    return response
+
+def connection_stats(stats=None):
+    # Totals for the process, or for one tracked `stats`.
+    source = _stats if stats is None else stats
+    with _stats_lock:
+        opened, checkouts = source["opened"], source["checkouts"]
+    return {"opened": opened, "reused": max(checkouts - opened, 0), "requests": checkouts}
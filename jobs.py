@@ -0,0 +1,93 @@
+# jobs.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 4
+JOB_TTL = 15 * 60  # finished jobs are kept this long for late pollers
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="scrape-job")
+_jobs = {}
+_active = {}
+_lock = threading.Lock()
+
+class Job:
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.trials = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def add_trial(self, trial):
+        with self._cond:
+            self.trials.append(trial)
+            self._cond.notify_all()
+
+    def _finish(self, status, result=None, error=None):
+        with self._cond:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout):
+        # Block until there are more than `seen` partial trials or the job ends.
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.trials) > seen or self.done, timeout)
+
+    def snapshot(self, since=0):
+        with self._cond:
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                "count": len(self.trials),
+                "trials": self.trials[since:],
+                "result": self.result,
+                "error": self.error,
+            }
+
+def _run(job, func, args):
+    job.status = "running"
+    try:
+        job._finish("done", result=func(job, *args))
+    except Exception as e:
+        print(f"Job {job.id} {job.key} failed: {e}")
+        job._finish("failed", error=str(e))
+    finally:
+        with _lock:
+            if _active.get(job.key) is job:
+                del _active[job.key]
+
+def _purge_finished():
+    cutoff = time.time() - JOB_TTL
+    for job_id in [j.id for j in _jobs.values() if j.finished and j.finished < cutoff]:
+        del _jobs[job_id]
+
+def submit(key, func, *args):
+    # Identical jobs already queued or running are coalesced into one.
+    with _lock:
+        _purge_finished()
+        job = _active.get(key)
+        if job is not None:
+            return job, False
+        job = Job(key)
+        _jobs[job.id] = job
+        _active[key] = job
+    _executor.submit(_run, job, func, args)
+    return job, True
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
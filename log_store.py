@@ -0,0 +1,519 @@
+# log_store.py
+
+import base64
+import bisect
+import datetime
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+import dateutil.parser
+import file_lock
+
+# The audit log as append-only JSON Lines segments. An entry is one line
+# ({"timestamp", "email", "action", "details"}) written with a single append,
+# so adding one never rewrites what is already there. Deleting appends a
+# tombstone ({"op": "delete", ...} or {"op": "delete_user", ...}) that hides
+# the matching earlier entries; compact() rewrites the segments without them.
+#
+# MANIFEST names the live segments in order, the last being the one appended
+# to. Rotation and compaction write new segment files first and then replace
+# MANIFEST in one rename, so a crash leaves either the old or the new set.
+#
+# Each process keeps an index of email -> live entry positions. Writers hold
+# LOCK_FILE and only ever append or replace MANIFEST, so the index catches up
+# by reading the bytes added since it last looked, and rebuilds when the
+# segment list changes.
+
+FSYNC_ALWAYS = "always"      # fsync after every append
+FSYNC_INTERVAL = "interval"  # fsync at most every FSYNC_INTERVAL_SECONDS
+FSYNC_NEVER = "never"        # leave it to the OS
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+FSYNC_INTERVAL_SECONDS = 1.0
+
+SEGMENT_BYTES = 4 * 1024 * 1024
+COMPACT_MIN_DEAD = 1000  # deletes compact once dead records pass this and outnumber live ones
+
+MANIFEST = "MANIFEST"
+LOCK_FILE = "LOCK"  # held by whichever process is appending, rotating or compacting
+
+# Timestamps are written in one fixed-width UTC form, so they sort as strings.
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+DISPLAY_FORMAT = "%Y-%m-%d %H:%M:%S"
+QUERY_LIMIT = 100
+MAX_QUERY_LIMIT = 1000
+
+def _segment_name(number):
+    return f"segment-{number:08d}.jsonl"
+
+def _segment_number(name):
+    return int(name[len("segment-"):-len(".jsonl")])
+
+def _encode(record):
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+def new_entry(action, email, details="", now=None):
+    # An audit entry with its timestamp already in sortable and display form.
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return {
+        "timestamp": now.strftime(TIMESTAMP_FORMAT),
+        "time": now.strftime(DISPLAY_FORMAT),
+        "email": email,
+        "action": action,
+        "details": details,
+    }
+
+def normalize_timestamp(value):
+    # TIMESTAMP_FORMAT form of an ISO date or datetime (naive means UTC), or
+    # None if it does not parse. Entries from the old logs.json go through here.
+    if len(value) == 27 and value[10] == "T" and value[-1] == "Z":
+        return value
+    try:
+        dt = dateutil.parser.isoparse(value)
+    except (ValueError, OverflowError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+def display_time(key):
+    return f"{key[:10]} {key[11:19]}"
+
+def _fsync_dir(directory):
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class LogStore:
+    def __init__(self, directory, fsync=FSYNC_INTERVAL, segment_bytes=SEGMENT_BYTES, legacy_file=None):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(FSYNC_POLICIES)}")
+        self.directory = directory
+        self.fsync = fsync
+        self.segment_bytes = segment_bytes
+        self.lock = threading.RLock()
+        self._writer = None      # (segment name, fd) of the segment being appended to
+        self._last_sync = 0.0
+        self._readers = {}       # segment name -> binary file open for reading
+        self._manifest_stat = None
+        self._pid = os.getpid()
+        self._locked = False     # this process holds LOCK_FILE
+        self._reset_index([])
+        os.makedirs(directory, exist_ok=True)
+        with self._exclusive():
+            if not os.path.exists(self._path(MANIFEST)):
+                self._create(legacy_file)
+            self._catch_up()
+
+    @contextmanager
+    def _exclusive(self):
+        # The in-process lock plus LOCK_FILE, which every process takes before
+        # it changes the files. Reentrant within a thread.
+        with self.lock:
+            if self._locked:
+                yield
+                return
+            with file_lock.file_lock(self._path(LOCK_FILE)):
+                self._locked = True
+                try:
+                    yield
+                finally:
+                    self._locked = False
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Manifest and segment files
+
+    def _read_manifest(self):
+        with open(self._path(MANIFEST), encoding="utf-8") as f:
+            return json.load(f)["segments"]
+
+    def _write_manifest(self, segments, **extra):
+        tmp = self._path(MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segments": segments, **extra}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(MANIFEST))
+        _fsync_dir(self.directory)
+
+    def _write_segments(self, records, first_number):
+        # Writes records into fresh, fsynced segments of about segment_bytes each.
+        names, f, number = [], None, first_number
+        try:
+            for record in records:
+                if f is None or f.tell() >= self.segment_bytes:
+                    if f is not None:
+                        f.flush()
+                        os.fsync(f.fileno())
+                        f.close()
+                    names.append(_segment_name(number))
+                    f = open(self._path(names[-1]), "wb")
+                    number += 1
+                f.write(_encode(record))
+            if f is None:
+                names.append(_segment_name(number))
+                f = open(self._path(names[-1]), "wb")
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            if f is not None:
+                f.close()
+        return names
+
+    def _create(self, legacy_file):
+        # New store, seeded from the old single-file logs.json when there is one.
+        # That file is left where it is; the manifest records that it was imported.
+        records, extra = [], {}
+        if legacy_file and os.path.exists(legacy_file):
+            with open(legacy_file, encoding="utf-8") as f:
+                legacy = json.load(f)
+            for email, entries in legacy.items():
+                records.extend({**entry, "email": entry.get("email", email)} for entry in entries)
+            records.sort(key=lambda entry: entry.get("timestamp", ""))
+            extra = {"migrated_from": os.path.abspath(legacy_file), "migrated_entries": len(records)}
+        self._write_manifest(self._write_segments(records, 1), **extra)
+
+    # Index
+
+    def _reset_index(self, segments):
+        self.segments = list(segments)
+        self._scanned = {}   # segment name -> bytes indexed so far
+        self._records = 0    # entries and tombstones in the live segments
+        self._next_id = 0
+        self._meta = {}      # entry id -> (segment name, offset, timestamp, sort key, email, action)
+        # None (everything), ("email", e) and ("action", a) -> [(sort key, email, entry id)], sorted
+        self._sorted = {None: []}
+        # Rollups, kept up to date as entries come and go.
+        self._daily = Counter()  # (day, action) -> entries
+        self._by_user = {}       # email -> Counter of actions
+
+    def _catch_up(self):
+        # Brings the index up to date with the files on disk.
+        if os.getpid() != self._pid:
+            # A forked worker: the descriptors are the parent's, with shared offsets.
+            self._writer, self._readers, self._pid = None, {}, os.getpid()
+        stat = os.stat(self._path(MANIFEST))
+        stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stat != self._manifest_stat:
+            segments = self._read_manifest()
+            if segments[:len(self.segments)] != self.segments:
+                self._close_files()
+                self._reset_index([])
+            self.segments = segments
+            self._manifest_stat = stat
+            self._remove_orphans()
+            for name in self.segments:
+                self._scan(name)
+        else:
+            self._scan(self.segments[-1])  # only the active segment grows
+
+    def _scan(self, name):
+        start = self._scanned.get(name, 0)
+        try:
+            if os.path.getsize(self._path(name)) <= start:
+                return
+        except FileNotFoundError:
+            return
+        with open(self._path(name), "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # a write still in progress; picked up next time
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None  # a torn line left by a crash
+                if isinstance(record, dict):
+                    self._index(record, name, offset)
+                offset += len(line)
+        self._scanned[name] = offset
+
+    def _index(self, record, name, offset):
+        self._records += 1
+        op = record.get("op")
+        email = record.get("email", "")
+        if op is None:
+            self._add(record, name, offset)
+        elif op == "delete_user":
+            self._remove(email, self._sorted.get(("email", email), []))
+        elif op == "delete":
+            self._remove(email, [item for item in self._sorted.get(("email", email), [])
+                                 if self._meta[item[2]][2] == record.get("timestamp")])
+
+    def _add(self, record, name, offset):
+        timestamp = record.get("timestamp", "")
+        key = normalize_timestamp(timestamp) or timestamp
+        email, action = record.get("email", ""), record.get("action", "")
+        entry_id = self._next_id
+        self._next_id += 1
+        self._meta[entry_id] = (name, offset, timestamp, key, email, action)
+        item = (key, email, entry_id)
+        for index in (None, ("email", email), ("action", action)):
+            items = self._sorted.setdefault(index, [])
+            if not items or items[-1] < item:
+                items.append(item)  # the usual case: entries arrive in time order
+            else:
+                bisect.insort(items, item)
+        self._daily[key[:10], action] += 1
+        self._by_user.setdefault(email, Counter())[action] += 1
+
+    def _remove(self, email, items):
+        if not items:
+            return
+        gone = {item[2] for item in items}
+        actions = Counter(self._meta[entry_id][5] for entry_id in gone)
+        for entry_id in gone:
+            _, _, _, key, _, action = self._meta.pop(entry_id)
+            self._daily[key[:10], action] -= 1
+            if not self._daily[key[:10], action]:
+                del self._daily[key[:10], action]
+        for index in [None, ("email", email)] + [("action", action) for action in actions]:
+            kept = [item for item in self._sorted[index] if item[2] not in gone]
+            if kept or index is None:
+                self._sorted[index] = kept
+            else:
+                del self._sorted[index]
+        self._by_user[email] -= actions
+        if not self._by_user[email]:
+            del self._by_user[email]
+
+    def _remove_orphans(self):
+        # Segments left behind by a compaction or rotation that did not finish,
+        # or by one that finished but had not cleaned up yet.
+        live = set(self.segments)
+        for name in os.listdir(self.directory):
+            if name.startswith("segment-") and name.endswith(".jsonl") and name not in live:
+                if self.segments and _segment_number(name) > _segment_number(self.segments[-1]):
+                    continue  # possibly being written by another process right now
+                try:
+                    os.remove(self._path(name))
+                except OSError:
+                    pass
+
+    def _close_files(self):
+        if self._writer is not None:
+            self._sync(force=True)
+            os.close(self._writer[1])
+            self._writer = None
+        for f in self._readers.values():
+            f.close()
+        self._readers = {}
+
+    # Writing
+
+    def _sync(self, force=False):
+        if self._writer is None or self.fsync == FSYNC_NEVER and not force:
+            return
+        now = time.monotonic()
+        if force or self.fsync == FSYNC_ALWAYS or now - self._last_sync >= FSYNC_INTERVAL_SECONDS:
+            os.fsync(self._writer[1])
+            self._last_sync = now
+
+    def _writer_fd(self):
+        active = self.segments[-1]
+        if self._writer is not None and self._writer[0] != active:
+            self._sync(force=True)
+            os.close(self._writer[1])
+            self._writer = None
+        if self._writer is None:
+            flags = os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, "O_BINARY", 0)
+            self._writer = (active, os.open(self._path(active), flags, 0o644))
+        return self._writer[1]
+
+    def _rotate_if_full(self):
+        active = self.segments[-1]
+        if self._scanned.get(active, 0) < self.segment_bytes:
+            return
+        name = _segment_name(_segment_number(active) + 1)
+        open(self._path(name), "ab").close()
+        self._write_manifest(self.segments + [name])
+        self._catch_up()
+
+    def _append(self, record):
+        with self._exclusive():
+            self._catch_up()
+            self._rotate_if_full()
+            os.write(self._writer_fd(), _encode(record))  # one write, so lines never interleave
+            self._sync()
+            self._catch_up()
+
+    def append(self, entry):
+        self._append(entry)
+        return entry
+
+    def delete(self, email, timestamp):
+        # Hides the user's entries with this timestamp. Returns how many there were.
+        with self._exclusive():
+            self._catch_up()
+            count = sum(1 for item in self._sorted.get(("email", email), [])
+                        if self._meta[item[2]][2] == timestamp)
+            if count:
+                self._append({"op": "delete", "email": email, "timestamp": timestamp})
+                self._maybe_compact()
+            return count
+
+    def delete_user(self, email):
+        with self._exclusive():
+            self._catch_up()
+            count = len(self._sorted.get(("email", email), []))
+            if count:
+                self._append({"op": "delete_user", "email": email})
+                self._maybe_compact()
+            return count
+
+    def flush(self):
+        with self.lock:
+            self._sync(force=True)
+
+    def close(self):
+        with self.lock:
+            self._close_files()
+
+    # Reading
+
+    def _read(self, entry_id):
+        name, offset, _, key = self._meta[entry_id][:4]
+        f = self._readers.get(name)
+        if f is None:
+            f = self._readers[name] = open(self._path(name), "rb")
+        f.seek(offset)
+        record = json.loads(f.readline())
+        record.setdefault("time", display_time(key))
+        return record
+
+    def entries(self, email=None):
+        # Every live entry, oldest first, for one user or everyone.
+        with self.lock:
+            self._catch_up()
+            return [self._read(item[2]) for item in self._sorted.get(None if email is None else ("email", email), [])]
+
+    def query(self, since=None, until=None, action=None, email=None, cursor=None, limit=QUERY_LIMIT):
+        # One page of entries, newest first, with since <= timestamp < until
+        # (normalized timestamps) and the given action and email. Pages
+        # continue from a cursor: the last entry's (timestamp, email) and how
+        # many entries sharing both have been returned so far.
+        with self.lock:
+            self._catch_up()
+            indexes = [index for index in (("email", email) if email else None, ("action", action) if action else None)
+                       if index is not None]
+            items = min((self._sorted.get(index, []) for index in indexes), key=len) if indexes else self._sorted[None]
+            lo = bisect.bisect_left(items, (since,)) if since else 0
+            hi = bisect.bisect_left(items, (until,)) if until else len(items)
+
+            def matches(item):
+                meta = self._meta[item[2]]
+                return (not email or meta[4] == email) and (not action or meta[5] == action)
+
+            total = hi - lo if len(indexes) < 2 else sum(1 for item in items[lo:hi] if matches(item))
+            i = hi - 1
+            if cursor is not None:
+                key, cursor_email, skip = cursor
+                i = min(i, bisect.bisect_right(items, (key, cursor_email, float("inf"))) - 1)
+                while skip and i >= lo and items[i][:2] == (key, cursor_email):
+                    if matches(items[i]):
+                        skip -= 1
+                    i -= 1
+            page = []
+            while i >= lo and len(page) <= limit:
+                if matches(items[i]):
+                    page.append(items[i])
+                i -= 1
+            next_cursor = None
+            if len(page) > limit:
+                page = page[:limit]
+                key, last_email = page[-1][:2]
+                shown = sum(1 for item in page if item[:2] == (key, last_email))
+                if cursor is not None and cursor[:2] == (key, last_email):
+                    shown += cursor[2]
+                next_cursor = (key, last_email, shown)
+            return {"total": total, "entries": [self._read(item[2]) for item in page], "next_cursor": next_cursor}
+
+    def daily_counts(self, since=None, until=None, action=None):
+        # [{"day", "action", "count"}] by day, from the rollup. since/until are
+        # normalized timestamps; any day they touch is counted in full.
+        first = since[:10] if since else ""
+        last = until[:10] if until else "9999-12-31"
+        if until and until[10:] == "T00:00:00.000000Z":
+            last = (datetime.date.fromisoformat(last) - datetime.timedelta(days=1)).isoformat()
+        with self.lock:
+            self._catch_up()
+            return [
+                {"day": day, "action": day_action, "count": count}
+                for (day, day_action), count in sorted(self._daily.items())
+                if first <= day <= last and (not action or day_action == action)
+            ]
+
+    def user_counts(self):
+        # [{"email", "total", "actions", "last"}], busiest user first.
+        with self.lock:
+            self._catch_up()
+            users = [
+                {
+                    "email": email,
+                    "total": sum(actions.values()),
+                    "actions": dict(actions),
+                    "last": display_time(self._sorted[("email", email)][-1][0]),
+                }
+                for email, actions in self._by_user.items()
+            ]
+            return sorted(users, key=lambda user: (-user["total"], user["email"]))
+
+    def users(self):
+        with self.lock:
+            self._catch_up()
+            return list(self._by_user)
+
+    def stats(self):
+        with self.lock:
+            self._catch_up()
+            return {
+                "segments": len(self.segments),
+                "bytes": sum(self._scanned.get(name, 0) for name in self.segments),
+                "records": self._records,
+                "live": len(self._meta),
+                "dead": self._records - len(self._meta),
+                "users": len(self._by_user),
+                "fsync": self.fsync,
+            }
+
+    # Compaction
+
+    def _maybe_compact(self):
+        dead = self._records - len(self._meta)
+        if dead >= COMPACT_MIN_DEAD and dead > len(self._meta):
+            self.compact()
+
+    def compact(self):
+        # Rewrites the live entries into new segments, dropping deleted entries
+        # and tombstones. Returns the number of records removed.
+        with self._exclusive():
+            self._catch_up()
+            before = self._records
+            records = self.entries()
+            old = list(self.segments)
+            names = self._write_segments(records, _segment_number(old[-1]) + 1)
+            self._write_manifest(names)
+            self._catch_up()
+            return before - self._records
+
+def encode_cursor(cursor):
+    return base64.urlsafe_b64encode(json.dumps(list(cursor)).encode("utf-8")).decode("ascii")
+
+def decode_cursor(text):
+    # ValueError for anything encode_cursor could not have produced.
+    value = json.loads(base64.urlsafe_b64decode(text.encode("ascii")))
+    if not isinstance(value, list) or len(value) != 3:
+        raise ValueError("Invalid cursor")
+    key, email, shown = value
+    if not isinstance(key, str) or not isinstance(email, str) or not isinstance(shown, int) or isinstance(shown, bool):
+        raise ValueError("Invalid cursor")
+    return key, email, shown
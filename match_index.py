@@ -0,0 +1,218 @@
+# match_index.py
+
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import catalogue
+import features as patient_features
+import matcher
+import screener
+
+MAX_INDEXES = 8
+
+# Patient "Cancer type" values that are filed under a different catalogue cancer type.
+CANCER_SITES = {
+    "myeloma": "multiple_myeloma",
+    "prostate": "genitourinary",
+}
+
+ELIGIBLE, UNSCREENED, INELIGIBLE = "eligible", "unscreened", "ineligible"
+
+# Number of failed criteria for every uint16 failure mask.
+POPCOUNT = np.array([bin(mask).count("1") for mask in range(1 << 16)], dtype=np.uint8)
+
+def patient_site(country, cancer):
+    cancer = catalogue.normalize(cancer)
+    return catalogue.normalize(country), CANCER_SITES.get(cancer, cancer)
+
+def _exclusion_key(exclusion_count):
+    return float("inf") if exclusion_count is None else exclusion_count
+
+class MatchIndex:
+    # Ranked patient <-> trial lookups for one patient file. refresh() brings
+    # it up to date with the file and the catalogue; queries only read it.
+    # Per patient, trials rank as eligible, then unscreened trials at the
+    # patient's site, then ineligible; within a tier by the number of failed
+    # criteria and then the trial's exclusion count.
+
+    def __init__(self, patient_file):
+        self.patient_file = patient_file
+        self.digest = None
+        self.stamp = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        features, digest = patient_features.load_features(self.patient_file)
+        stamp = catalogue.catalogue_stamp()
+        if digest == self.digest and stamp == self.stamp:
+            return
+        rebuild = stamp != self.stamp
+        if rebuild:
+            self._load_trials()
+        # Only new or edited rows miss the eligibility cache here.
+        failures, _ = matcher.evaluate_cached(features, self.screened)
+        if rebuild or self.digest is None or len(features) != len(self.features):
+            rows = np.arange(len(features))
+            self.order = np.empty(failures.shape, dtype=np.int32)
+        else:
+            rows = np.flatnonzero(features["row_hash"].to_numpy() != self.features["row_hash"].to_numpy())
+        regroup = len(rows) == len(features)
+        self.features = features
+        self.failures = failures
+        self.failed = POPCOUNT[failures]
+        self._rank_patients(rows)
+        self._rank_trials()
+        if regroup:
+            self._group_patients()
+        else:
+            self._regroup_patients(rows)
+        self.digest, self.stamp = digest, stamp
+
+    def _load_trials(self):
+        matcher.load_screening_trials()  # imports trials.json into an empty catalogue
+        sites = catalogue.sites_by_trial()
+        trials = catalogue.find_trials(status="RECRUITING")
+        self.trials = {t["trial_id"]: t for t in trials}
+        self.sites = {trial_id: sites.get(trial_id, []) for trial_id in self.trials}
+        structured = sorted((t for t in trials if t["criteria"]), key=lambda t: _exclusion_key(t["exclusion_count"]))
+        self.screened = [
+            {"trial_id": t["trial_id"], "name": t["name"], "version": t["version"], **t["criteria"]}
+            for t in structured
+        ]
+        self.column = {t["trial_id"]: j for j, t in enumerate(self.screened)}
+        # Unscreened trials per (country, cancer type) site, best first; "" is any country.
+        self.by_site = {}
+        for t in sorted(trials, key=lambda t: _exclusion_key(t["exclusion_count"])):
+            if t["criteria"]:
+                continue
+            for site in self.sites[t["trial_id"]]:
+                self.by_site.setdefault(site, []).append(t["trial_id"])
+
+    def _rank_patients(self, rows):
+        # Screened trials are already in exclusion-count order, so a stable sort
+        # on failed-criteria count gives the in-tier order.
+        if len(rows):
+            self.order[rows] = np.argsort(self.failed[rows], axis=1, kind="stable")
+
+    def _rank_trials(self):
+        self.trial_order = np.argsort(self.failed, axis=0, kind="stable")
+
+    def _site_of(self, i):
+        return patient_site(str(self.features["country"].iat[i]), str(self.features["cancer"].iat[i]))
+
+    def _group_patients(self):
+        pairs = self.features["country"].astype(str) + "\x1f" + self.features["cancer"].astype(str)
+        codes, uniques = pd.factorize(pairs)
+        sites = [patient_site(*pair.split("\x1f")) for pair in uniques]
+        self.patient_sites = [sites[code] for code in codes]
+        self.by_patient_site = {}
+        for code, site in enumerate(sites):
+            self.by_patient_site.setdefault(site, set()).update(np.flatnonzero(codes == code).tolist())
+        self.rows = {}
+        for i, patient_id in enumerate(self.features["patient_id"]):
+            self.rows.setdefault(patient_id, i)
+
+    def _regroup_patients(self, rows):
+        # Edited rows may have moved site; nothing else needs touching.
+        for i in rows:
+            site = self._site_of(i)
+            if site != self.patient_sites[i]:
+                self.by_patient_site[self.patient_sites[i]].discard(i)
+                self.by_patient_site.setdefault(site, set()).add(i)
+                self.patient_sites[i] = site
+            self.rows.setdefault(self.features["patient_id"].iat[i], i)
+
+    def _site_trials(self, i):
+        country, cancer = self.patient_sites[i]
+        return self.by_site.get((country, cancer), []) + self.by_site.get(("", cancer), [])
+
+    def _trial_entry(self, trial_id, tier, mask=0):
+        trial = self.trials[trial_id]
+        return {
+            "trial_id": trial_id,
+            "name": trial["name"],
+            "link": trial["link"],
+            "status": trial["status"],
+            "eligibility": trial["eligibility"],
+            "exclusion_count": None if _exclusion_key(trial["exclusion_count"]) == float("inf") else trial["exclusion_count"],
+            "tier": tier,
+            "failed": screener.failed_criteria(int(mask)),
+        }
+
+    def trials_for_patient(self, patient_id, k=10):
+        i = self.rows.get(patient_id)
+        if i is None:
+            return None
+        ranked = []
+        order = self.order[i]
+        eligible = int((self.failures[i] == 0).sum())
+        for j in order[:eligible]:
+            ranked.append(self._trial_entry(self.screened[j]["trial_id"], ELIGIBLE))
+        seen = set()
+        for trial_id in self._site_trials(i):
+            if len(ranked) >= k:
+                break
+            if trial_id not in seen:
+                seen.add(trial_id)
+                ranked.append(self._trial_entry(trial_id, UNSCREENED))
+        for j in order[eligible:]:
+            if len(ranked) >= k:
+                break
+            ranked.append(self._trial_entry(self.screened[j]["trial_id"], INELIGIBLE, self.failures[i, j]))
+        return ranked[:k]
+
+    def _patient_entry(self, i, tier, mask=0):
+        return {
+            "id": self.features["patient_id"].iat[i],
+            "name": self.features["name"].iat[i],
+            "cancer": self.features["cancer"].iat[i],
+            "tier": tier,
+            "failed": screener.failed_criteria(int(mask)),
+        }
+
+    def patients_for_trial(self, trial_id, offset=0, limit=matcher.PAGE_SIZE):
+        if trial_id not in self.trials:
+            return None
+        j = self.column.get(trial_id)
+        if j is not None:
+            rows = self.trial_order[:, j]
+            page = [
+                self._patient_entry(i, ELIGIBLE if self.failures[i, j] == 0 else INELIGIBLE, self.failures[i, j])
+                for i in rows[offset:offset + limit]
+            ]
+            return {"total": len(rows), "patients": page}
+        rows = sorted({
+            i
+            for country, cancer in self.sites[trial_id]
+            for site, members in self.by_patient_site.items()
+            if site[1] == cancer and (not country or site[0] == country)
+            for i in members
+        })
+        page = [self._patient_entry(i, UNSCREENED) for i in rows[offset:offset + limit]]
+        return {"total": len(rows), "patients": page}
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+def get_index(patient_file):
+    with _lock:
+        index = _indexes.get(patient_file)
+        if index is None:
+            index = _indexes[patient_file] = MatchIndex(patient_file)
+            while len(_indexes) > MAX_INDEXES:
+                _indexes.popitem(last=False)
+        _indexes.move_to_end(patient_file)
+    return index
+
+def trials_for_patient(patient_file, patient_id, k=10):
+    index = get_index(patient_file)
+    with index.lock:
+        index.refresh()
+        return index.trials_for_patient(patient_id, k)
+
+def patients_for_trial(patient_file, trial_id, offset=0, limit=matcher.PAGE_SIZE):
+    index = get_index(patient_file)
+    with index.lock:
+        index.refresh()
+        return index.patients_for_trial(trial_id, offset, limit)
@@ -1,4 +1,160 @@
-def run_screening():
-    print("Screening patients against trials...")
-    # Placeholder logic
-    return {"status": "ok", "message": "Screening completed"}
\ No newline at end of file
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import catalogue
+import eligibility_cache
+import features as patient_features
+import metrics
+import screener
+
+CHUNK_SIZE = 5000          # patients per process-pool task
+MAX_WORKERS = os.cpu_count() or 1
+PAGE_SIZE = 50             # patients per eligible/ineligible page
+MAX_STORED_SCREENINGS = 8  # results kept for paging, oldest dropped first
+
+_screenings = OrderedDict()
+_screenings_lock = threading.Lock()
+
+def load_screening_trials(cancer_type=None):
+    # Trials with structured criteria; trials.json is imported on first use.
+    trials = catalogue.find_trials(cancer_type=cancer_type, structured_only=True)
+    if not trials and cancer_type is None and os.path.exists(catalogue.TRIALS_JSON):
+        catalogue.import_trials_json()
+        trials = catalogue.find_trials(structured_only=True)
+    return [
+        {"trial_id": t["trial_id"], "name": t["name"], "version": t["version"], **t["criteria"]}
+        for t in trials
+    ]
+
+_worker_compiled = None
+
+def _init_worker(trials):
+    global _worker_compiled
+    _worker_compiled = [screener.compile_trial(trial) for trial in trials]
+
+def _screen_chunk(chunk):
+    result = screener.screen_matrix(chunk, None, compiled=_worker_compiled)
+    return result["failures"]
+
+def evaluate(features, trials, workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    # Small uploads are screened inline; larger ones are split across processes.
+    if len(features) <= chunk_size or workers <= 1:
+        return screener.screen_matrix(features, trials)["failures"]
+    chunks = [features.iloc[start:start + chunk_size] for start in range(0, len(features), chunk_size)]
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=_init_worker, initargs=(trials,)) as pool:
+        return np.vstack(list(pool.map(_screen_chunk, chunks)))
+
+def evaluate_cached(features, trials, workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    # Only (patient, trial) cells missing from the eligibility cache are screened.
+    # Trials with nothing cached (new or re-scraped) are screened for every
+    # patient; the rest only for patients whose row is new or edited.
+    keys = eligibility_cache.row_keys(features)
+    cached = eligibility_cache.lookup(keys, trials)
+    missing = cached == eligibility_cache.MISSING
+    cold = np.flatnonzero(missing.all(axis=0))
+    warm = np.setdiff1d(np.arange(len(trials)), cold)
+    computed = 0
+    if len(cold):
+        cold_trials = [trials[j] for j in cold]
+        fresh = evaluate(features, cold_trials, workers, chunk_size)
+        cached[:, cold] = fresh
+        eligibility_cache.store(keys, cold_trials, fresh)
+        computed += fresh.size
+    rows = np.flatnonzero(missing[:, warm].any(axis=1)) if len(warm) else []
+    if len(rows):
+        warm_trials = [trials[j] for j in warm]
+        fresh = evaluate(features.iloc[rows], warm_trials, workers, chunk_size)
+        cached[np.ix_(rows, warm)] = fresh
+        eligibility_cache.store(keys[rows], warm_trials, fresh)
+        computed += fresh.size
+    return cached.astype(np.uint16), {"cells": int(cached.size), "computed": computed}
+
+def _store(screening):
+    with _screenings_lock:
+        _screenings[screening["id"]] = screening
+        while len(_screenings) > MAX_STORED_SCREENINGS:
+            _screenings.popitem(last=False)
+
+def get_screening(screening_id):
+    with _screenings_lock:
+        return _screenings.get(screening_id)
+
+def result_page(screening, trial_id, eligible=True, offset=0, limit=PAGE_SIZE):
+    # One page of eligible or ineligible patients for a trial. Reasons are
+    # only worked out for the patients on the page.
+    j = next((j for j, t in enumerate(screening["trials"]) if t["trial_id"] == trial_id), None)
+    if j is None:
+        return None
+    failures = screening["failures"][:, j]
+    rows = np.flatnonzero(failures == 0 if eligible else failures != 0)
+    features = screening["features"]
+    patients = []
+    for i in rows[offset:offset + limit]:
+        patient = {
+            "id": features["patient_id"].iat[i],
+            "name": features["name"].iat[i],
+            "cancer": features["cancer"].iat[i],
+        }
+        if not eligible:
+            patient["reasons"] = screener.explain(features, screening["trials"], i, j)
+        patients.append(patient)
+    return {
+        "trial_id": trial_id,
+        "status": "eligible" if eligible else "ineligible",
+        "total": int(len(rows)),
+        "offset": offset,
+        "patients": patients,
+    }
+
+def run_screening(patient_file, cancer_type=None, workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    timings = {}
+    started = time.perf_counter()
+
+    features, file_hash = patient_features.load_features(patient_file)
+    timings["load"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    trials = load_screening_trials(cancer_type)
+    for trial in trials:
+        screener.compile_trial(trial)  # fail early on malformed criteria
+    timings["compile"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    failures, cells = evaluate_cached(features, trials, workers, chunk_size)
+    timings["evaluate"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    screening = {
+        "id": uuid.uuid4().hex,
+        "created": time.time(),
+        "file_hash": file_hash,
+        "features": features,
+        "trials": trials,
+        "failures": failures,
+    }
+    _store(screening)
+    summary = {
+        "screening_id": screening["id"],
+        "patients": len(features),
+        "cells": cells,
+        "trials": [
+            {
+                "trial_id": trial["trial_id"],
+                "name": trial["name"],
+                "eligible": result_page(screening, trial["trial_id"], eligible=True),
+                "ineligible": result_page(screening, trial["trial_id"], eligible=False),
+            }
+            for trial in trials
+        ],
+    }
+    timings["serialize"] = time.perf_counter() - mark
+    timings["total"] = time.perf_counter() - started
+    summary["timings_ms"] = {stage: round(seconds * 1000, 1) for stage, seconds in timings.items()}
+    for stage, seconds in timings.items():
+        metrics.observe("screening_stage_duration_seconds", seconds, stage=stage)
+    print(f"Screened {len(features)} patients against {len(trials)} trials: {summary['timings_ms']}")
+    return summary
@@ -0,0 +1,142 @@
+# metrics.py
+
+import cProfile
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# In-process counters and histograms, rendered in the Prometheus text format
+# at /metrics. Each worker process keeps and reports its own; Prometheus adds
+# them up across targets.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    "http_requests_total": "HTTP requests by route, method and status.",
+    "http_request_duration_seconds": "Time to produce a response, by route and method.",
+    "scraper_stage_duration_seconds": "Time spent in each scraper stage.",
+    "patient_load_duration_seconds": "Time to load a patient file, by what was loaded.",
+    "screening_stage_duration_seconds": "Time spent in each stage of a screening run.",
+    "slow_request_profiles_total": "cProfile dumps written for slow requests.",
+}
+
+_lock = threading.Lock()
+_counters = {}    # name -> {labels: value}
+_histograms = {}  # name -> {labels: [count per bucket..., sum, count]}
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def inc(name, amount=1, **labels):
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+def observe(name, seconds, **labels):
+    key = _labels(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+@contextmanager
+def span(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _series(name, labels, value, extra=()):
+    pairs = ",".join(f'{key}="{_escape(val)}"' for key, val in labels + tuple(extra))
+    return f"{name}{{{pairs}}} {value}" if pairs else f"{name} {value}"
+
+def _header(lines, name, kind):
+    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+    lines.append(f"# TYPE {name} {kind}")
+
+def render():
+    lines = []
+    with _lock:
+        for name, series in sorted(_counters.items()):
+            _header(lines, name, "counter")
+            for labels, value in sorted(series.items()):
+                lines.append(_series(name, labels, value))
+        for name, series in sorted(_histograms.items()):
+            _header(lines, name, "histogram")
+            for labels, values in sorted(series.items()):
+                for bound, count in zip(LATENCY_BUCKETS, values):
+                    lines.append(_series(f"{name}_bucket", labels, count, [("le", repr(bound))]))
+                lines.append(_series(f"{name}_bucket", labels, values[-1], [("le", "+Inf")]))
+                lines.append(_series(f"{name}_sum", labels, round(values[-2], 6)))
+                lines.append(_series(f"{name}_count", labels, values[-1]))
+    return "\n".join(lines) + "\n"
+
+def instrument(app):
+    # Times every request by route template (not raw path, which would make a
+    # series per patient or trial id). With app.config["PROFILE_SLOW_MS"]
+    # set, every request also runs under cProfile and the ones slower than
+    # that are dumped to app.config["PROFILE_DIR"] for `python -m pstats`.
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+        if app.config.get("PROFILE_SLOW_MS"):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # another request's profiler is running (Python 3.12+ allows one)
+            g.profiler = profiler
+
+    @app.after_request
+    def _record(response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed * 1000 >= float(app.config["PROFILE_SLOW_MS"]):
+                _dump_profile(app, profiler, elapsed)
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        inc("http_requests_total", route=route, method=request.method, status=response.status_code)
+        observe("http_request_duration_seconds", elapsed, route=route, method=request.method)
+        return response
+
+    @app.teardown_request
+    def _stop_profiler(exc):
+        # after_request is skipped when a view raises. A profiler left
+        # running would make every later enable() fail (Python 3.12+ allows
+        # one), so profiling would stop for the rest of the process.
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+
+def _dump_profile(app, profiler, elapsed):
+    from flask import request
+    directory = app.config.get("PROFILE_DIR", "profiles")
+    os.makedirs(directory, exist_ok=True)
+    route = re.sub(r"[^A-Za-z0-9]+", "_", request.url_rule.rule if request.url_rule else request.path).strip("_")
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{route or 'root'}-{int(elapsed * 1000)}ms-{os.getpid()}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+    inc("slow_request_profiles_total", route=request.url_rule.rule if request.url_rule else "unmatched")
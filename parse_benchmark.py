@@ -0,0 +1,195 @@
+# parse_benchmark.py
+#
+# Compares how the scraper used to parse cancertrials.ie pages (a full
+# html.parser tree built from response.text) with scraper.parse_html (only
+# the regions it reads, built from the raw bytes), without touching the
+# network:
+#
+#   python parse_benchmark.py                      # generated fixture pages
+#   python parse_benchmark.py --pages saved/       # saved listing-*.html / trial-*.html
+#   python parse_benchmark.py --save saved/        # write the generated pages out
+#
+# Prints parse time and peak traced memory per page for each way, and exits 1
+# if the two disagree on anything the scraper extracts from a page.
+
+import argparse
+import glob
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO)
+
+import requests
+from bs4 import BeautifulSoup
+import scraper
+
+SITE = "https://www.cancertrials.ie"
+WORDS = ("study phase randomised patients treatment cohort arm dose oncology Université Galway "
+         "Cork Dublin Beaumont St. James's Mater Tallaght Limerick Waterford Sligo Ó Ní").split()
+
+def _words(rng, count):
+    return " ".join(rng.choice(WORDS) for _ in range(count))
+
+def _chrome(rng, title, body):
+    # The WordPress theme around the content: head assets, a mega menu,
+    # sidebar widgets and footer, which is most of each real page.
+    head = "".join(f'<link rel="stylesheet" href="{SITE}/wp-content/css/{i}.css?ver=6.{i}" media="all">'
+                   for i in range(25))
+    scripts = "".join(f"<script>window.wp_{i}={{\"nonce\":\"{rng.getrandbits(64):x}\",\"items\":"
+                      f"[{','.join(str(rng.randrange(999)) for _ in range(40))}]}};</script>"
+                      for i in range(12))
+    menu = "".join(
+        f'<li class="menu-item menu-item-{i}"><a href="{SITE}/section-{i}/">{_words(rng, 2)}</a>'
+        f'<ul class="sub-menu">' + "".join(
+            f'<li class="menu-item"><a href="{SITE}/section-{i}/page-{j}/">{_words(rng, 3)}</a></li>'
+            for j in range(12)) + "</ul></li>"
+        for i in range(14))
+    sidebar = "".join(
+        f'<aside class="widget"><h3 class="widget-title">{_words(rng, 3)}</h3><ul>' + "".join(
+            f'<li><a href="{SITE}/news/{i}-{j}/">{_words(rng, 6)}</a> <span class="post-date">{_words(rng, 2)}</span></li>'
+            for j in range(8)) + "</ul></aside>"
+        for i in range(5))
+    footer = "".join(f'<div class="footer-widget"><p>{_words(rng, 40)}</p></div>' for _ in range(6))
+    return (f'<!DOCTYPE html><html lang="en-IE"><head><meta charset="UTF-8"><title>{title}</title>{head}</head>'
+            f'<body class="page"><header class="site-header"><nav class="main-navigation"><ul class="menu">{menu}'
+            f'</ul></nav></header><div class="site-content"><main class="content-area"><article>'
+            f'<div class="inside-article">{body}</div></article></main><div class="sidebar">{sidebar}</div></div>'
+            f'<footer class="site-footer">{footer}</footer>{scripts}</body></html>')
+
+def listing_page(rng, number, pages):
+    body = "".join(
+        f'<div class="trial-summary"><h3>{_words(rng, 6)}</h3><p>{_words(rng, 30)}</p>'
+        f'<a class="btn-login btn-xs" href="{SITE}/trial/trial-{number}-{i}/">View trial</a></div>'
+        for i in range(20))
+    nav = '<nav class="navigation paging-navigation"><div class="nav-links">'
+    nav += "".join(f'<a class="page-numbers" href="{SITE}/current-trials/breast/page/{p}/">{p}</a>'
+                   for p in range(1, pages + 1) if p != number)
+    if number < pages:
+        nav += f'<a class="next page-numbers" href="{SITE}/current-trials/breast/page/{number + 1}/">Next</a>'
+    nav += "</div></nav>"
+    return _chrome(rng, f"Breast - page {number}", body).replace("</main>", nav + "</main>")
+
+def trial_page(rng, number):
+    rows = [("Name:", f"ICORG {number:02d}-{rng.randrange(99):02d} {_words(rng, 4)}")]
+    rows += [(f"{_words(rng, 2)}:", _words(rng, rng.randrange(5, 60))) for _ in range(24)]
+    tables = "".join(
+        '<table class="table"><tbody>' + "".join(f"<tr><th>{k}</th><td>{v}</td></tr>" for k, v in part)
+        + "</tbody></table>"
+        for part in (rows[:13], rows[13:]))
+    # Some pages also have a heading whose button is not its next sibling,
+    # which 'h2 + a.btn-login' must not pick up; every third has no detail
+    # button at all.
+    sponsors = (f'<h2>Sponsors</h2><p>{_words(rng, 20)}</p>'
+                f'<a class="btn-login" href="{SITE}/sponsors/{number}/">Sponsor site</a>') if number % 2 else ""
+    details = (f'<h2>More Detailed Information</h2>'
+               f'<a class="btn-login" href="https://clinicaltrials.gov/study/NCT0{rng.randrange(10**7):07d}">'
+               f'ClinicalTrials.gov</a>') if number % 3 else ""
+    body = (f'<h1 class="entry-title">{rows[0][1]}</h1><p>{_words(rng, 80)}</p>{tables}'
+            f'{sponsors}{details}<p>{_words(rng, 40)}</p>')
+    return _chrome(rng, rows[0][1], body)
+
+def generate_pages(listings=5, trials=40, seed=4):
+    rng = random.Random(seed)
+    pages = {f"listing-{i}.html": listing_page(rng, i, listings) for i in range(1, listings + 1)}
+    pages.update({f"trial-{i}.html": trial_page(rng, i) for i in range(1, trials + 1)})
+    return {name: html.encode("utf-8") for name, html in pages.items()}
+
+def load_pages(directory):
+    pages = {}
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, "rb") as f:
+            pages[os.path.basename(path)] = f.read()
+    return pages
+
+def as_response(body, url):
+    response = requests.Response()
+    response._content = body
+    response.status_code = 200
+    response.url = url
+    response.headers["Content-Type"] = "text/html; charset=UTF-8"
+    return response
+
+def parse_old(response, parse_only):
+    return BeautifulSoup(response.text, "html.parser")
+
+def parse_new(response, parse_only):
+    return scraper.parse_html(response, parse_only)
+
+def extract(name, soup, url):
+    if name.startswith("listing"):
+        return scraper.read_listing(soup)
+    return scraper.read_trial_tables(soup), scraper.extract_detailed_info_link(soup, url)
+
+def parts(name):
+    return scraper.LISTING_PARTS if name.startswith("listing") else scraper.TRIAL_PAGE_PARTS
+
+def time_parse(parse, pages):
+    started = time.perf_counter()
+    for name, response in pages:
+        parse(response, parts(name))
+    return time.perf_counter() - started
+
+def peak_and_results(parse, pages):
+    # The largest traced peak while building and holding one page's tree, and
+    # what the scraper extracts from each page.
+    peak, results = 0, {}
+    tracemalloc.start()
+    try:
+        for name, response in pages:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            soup = parse(response, parts(name))
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+            results[name] = extract(name, soup, response.url)
+            del soup
+    finally:
+        tracemalloc.stop()
+    return peak, results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark scraper HTML parsing on saved pages.")
+    parser.add_argument("--pages", help="directory of saved listing-*.html and trial-*.html pages")
+    parser.add_argument("--save", help="write the generated pages to this directory and exit")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages) if args.pages else generate_pages()
+    if args.save:
+        os.makedirs(args.save, exist_ok=True)
+        for name, body in pages.items():
+            with open(os.path.join(args.save, name), "wb") as f:
+                f.write(body)
+        print(f"Wrote {len(pages)} pages to {args.save}")
+        return 0
+    if not pages:
+        sys.exit(f"No .html pages in {args.pages}")
+
+    responses = [(name, as_response(body, f"{SITE}/{name}")) for name, body in pages.items()]
+    size = sum(len(body) for body in pages.values())
+    print(f"{len(responses)} pages, {size / 1024:.0f} KiB, parser {scraper.HTML_PARSER}, best of {args.rounds}")
+
+    # Rounds alternate between the two so both see the same machine load;
+    # the best round of each is reported.
+    old_time = new_time = float("inf")
+    for _ in range(args.rounds):
+        old_time = min(old_time, time_parse(parse_old, responses))
+        new_time = min(new_time, time_parse(parse_new, responses))
+    old_peak, old_results = peak_and_results(parse_old, responses)
+    new_peak, new_results = peak_and_results(parse_new, responses)
+    for label, elapsed, peak in (("before", old_time, old_peak), ("after", new_time, new_peak)):
+        print(f"{label:>7}: {elapsed * 1000 / len(responses):7.2f} ms/page  "
+              f"peak {peak / 1024:8.0f} KiB/page")
+    print(f"{'':>7}  {old_time / new_time:6.1f}x faster, {old_peak / max(new_peak, 1):.1f}x less memory")
+
+    mismatched = [name for name in old_results if old_results[name] != new_results[name]]
+    for name in mismatched:
+        print(f"FAIL {name}: extracted data differs")
+    print("OK" if not mismatched else f"{len(mismatched)} pages differ")
+    return 1 if mismatched else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
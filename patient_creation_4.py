@@ -1,7 +1,6 @@
 import pandas as pd
 import random
 import os
-import matplotlib.pyplot as plt 
 
 # Parameters
 NUM_PATIENTS = 100
@@ -53,6 +52,14 @@ TREATMENTS = ["None", "Surgery", "Chemotherapy", "Radiotherapy", "Immunotherapy"
 
 GENDER = ["Male","Female"]
 
+# Column order of the generated CSV; uploads are validated against it.
+PATIENT_COLUMNS = [
+    "Patient ID", "Patient name", "Year of birth", "ECOG", "Gender", "Diagnosis type",
+    "Patient status on referral", "Disease group", "T stage", "N stage", "M stage", "Grade",
+    "Histology", "Mutations detected", "Previous treatment", "More than 1 treatment",
+    "Cancer type", "Country", "County"
+]
+
 this_year = 2025
 
 AGE_GROUPS = [
@@ -169,31 +176,33 @@ def generate_patients(num_patients, output_file):
                 })
                 patient_id += 1
 
-    df = pd.DataFrame(patients)
+    df = pd.DataFrame(patients, columns=PATIENT_COLUMNS)
     df.to_csv(output_file, index=False)
 
 
-# Run it
-generate_patients(NUM_PATIENTS, OUTPUT_FILE)
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
 
-# Data visualisation
-df = pd.read_csv(OUTPUT_FILE)
+    # Run it
+    generate_patients(NUM_PATIENTS, OUTPUT_FILE)
 
-bins = [6, 17, 28, 38, 48, 58, 68, 78, 90]
-labels = ["7–17", "18–28", "29–38", "39–48", "49–58", "59–68", "69–78", "79–90"]
+    # Data visualisation
+    df = pd.read_csv(OUTPUT_FILE)
 
-df["Age Group"] = pd.cut(df["Year of birth"], bins=bins, labels=labels, right=True, include_lowest=True)
+    bins = [6, 17, 28, 38, 48, 58, 68, 78, 90]
+    labels = ["7–17", "18–28", "29–38", "39–48", "49–58", "59–68", "69–78", "79–90"]
 
-grouped = df.groupby(["Age Group", "Cancer type"]).size().unstack(fill_value=0)
+    df["Age Group"] = pd.cut(df["Year of birth"], bins=bins, labels=labels, right=True, include_lowest=True)
 
-ax = grouped.plot(kind="bar", figsize=(12, 6))
-plt.title("Cancer Type Distribution by Age Group")
-plt.xlabel("Age Group")
-plt.ylabel("Number of Patients")
-plt.xticks(rotation=45)
-plt.grid(axis='y')
+    grouped = df.groupby(["Age Group", "Cancer type"]).size().unstack(fill_value=0)
 
-plt.legend(title="Cancer Type", bbox_to_anchor=(1.05, 1), loc='upper left')
-plt.tight_layout()
-plt.show()
+    ax = grouped.plot(kind="bar", figsize=(12, 6))
+    plt.title("Cancer Type Distribution by Age Group")
+    plt.xlabel("Age Group")
+    plt.ylabel("Number of Patients")
+    plt.xticks(rotation=45)
+    plt.grid(axis='y')
 
+    plt.legend(title="Cancer Type", bbox_to_anchor=(1.05, 1), loc='upper left')
+    plt.tight_layout()
+    plt.show()
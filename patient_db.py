@@ -0,0 +1,318 @@
+# patient_db.py
+
+import csv
+import datetime
+import io
+import itertools
+import json
+import os
+import db
+from patient_creation_4 import PATIENT_COLUMNS, T_STAGE, N_STAGE, M_STAGE
+
+# Uploaded patient files are imported into one SQLite database each, so a save
+# updates one row in a transaction instead of rewriting the whole CSV.
+#
+# meta.version goes up by one on every row update and each row remembers the
+# version it last changed at, so readers holding version v can catch up with
+# "WHERE version > v". meta.generation changes when the file is re-imported,
+# which invalidates everything a reader holds.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS patients (
+    row_no INTEGER PRIMARY KEY,
+    patient_key TEXT NOT NULL,
+    data TEXT NOT NULL,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS patients_by_key ON patients (patient_key);
+CREATE INDEX IF NOT EXISTS patients_by_version ON patients (version);
+"""
+
+ID_COLUMN = "Patient ID"
+
+def is_patient_db(path):
+    return path.endswith(".sqlite")
+
+def db_path_for(csv_path):
+    return os.path.splitext(csv_path)[0] + ".sqlite"
+
+def pad(row, width):
+    return row + [""] * (width - len(row)) if len(row) < width else row[:width]
+
+def patient_key(patient_id):
+    return (patient_id or "").strip().lower()
+
+def _connect(path):
+    return db.connect(path, SCHEMA)
+
+def _meta(conn):
+    return dict(conn.execute("SELECT key, value FROM meta"))
+
+UPLOAD_BATCH_SIZE = 1000
+MAX_REPORTED_REJECTS = 100
+
+class UploadTooLarge(ValueError):
+    pass
+
+class _CappedReader(io.RawIOBase):
+    # Passes bytes through from a binary stream, failing once `limit` is exceeded.
+    def __init__(self, raw, limit):
+        self.raw = raw
+        self.limit = limit
+        self.count = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        self.count += len(data)
+        if self.limit is not None and self.count > self.limit:
+            raise UploadTooLarge(f"Upload exceeds {self.limit} bytes")
+        buffer[:len(data)] = data
+        return len(data)
+
+def check_header(header):
+    missing = [c for c in PATIENT_COLUMNS if c not in header]
+    unexpected = [c for c in header if c not in PATIENT_COLUMNS]
+    if missing or unexpected or len(set(header)) != len(header):
+        problems = []
+        if missing:
+            problems.append(f"missing columns: {', '.join(missing)}")
+        if unexpected:
+            problems.append(f"unexpected columns: {', '.join(unexpected)}")
+        if len(set(header)) != len(header):
+            problems.append("duplicate columns")
+        raise ValueError("Invalid patient file header (" + "; ".join(problems) + ")")
+
+def _is_int(value, low, high):
+    try:
+        return low <= int(value) <= high
+    except ValueError:
+        return False
+
+VALIDATED_COLUMNS = ("Patient ID", "ECOG", "Year of birth", "T stage", "N stage", "M stage")
+
+def validate_field(column, value):
+    # The problem with one field's value, or None. Columns without rules pass.
+    if column == ID_COLUMN and not value.strip():
+        return "Patient ID is empty"
+    if column == "ECOG" and not _is_int(value, 0, 5):
+        return f"ECOG '{value}' is not an integer 0-5"
+    if column == "Year of birth" and not _is_int(value, 1900, datetime.date.today().year):
+        return f"Year of birth '{value}' is not a valid year"
+    for stage_column, allowed in (("T stage", T_STAGE), ("N stage", N_STAGE), ("M stage", M_STAGE)):
+        if column == stage_column and value.strip() not in allowed:
+            return f"{column} '{value}' is not one of {', '.join(allowed)}"
+    return None
+
+def validate_row(row, at):
+    # Row-level checks; `at` maps column name -> position. Returns a list of problems.
+    if len(row) != len(at):
+        return [f"expected {len(at)} fields, got {len(row)}"]
+    errors = (validate_field(column, row[at[column]]) for column in VALIDATED_COLUMNS)
+    return [error for error in errors if error]
+
+def patient_id_of(values):
+    # The "Patient ID" of an edit as text (JSON may carry it as a number), or
+    # None when it is missing, empty or not a string or integer.
+    patient_id = values.get(ID_COLUMN)
+    if isinstance(patient_id, int) and not isinstance(patient_id, bool):
+        patient_id = str(patient_id)
+    if not isinstance(patient_id, str) or not patient_id.strip():
+        return None
+    return patient_id.strip()
+
+def _replace_rows(conn, header, rows, source):
+    # Replaces the database contents inside the caller's transaction.
+    generation = int(_meta(conn).get("generation", 0)) + 1
+    key_at = header.index(ID_COLUMN) if ID_COLUMN in header else None
+    conn.execute("DELETE FROM patients")
+    row_no = 0
+    while True:
+        batch = list(itertools.islice(rows, UPLOAD_BATCH_SIZE))
+        if not batch:
+            break
+        conn.executemany(
+            "INSERT INTO patients (row_no, patient_key, data, version) VALUES (?, ?, ?, 0)",
+            [
+                (row_no + i, patient_key(row[key_at]) if key_at is not None and key_at < len(row) else "",
+                 json.dumps(row))
+                for i, row in enumerate(batch)
+            ],
+        )
+        row_no += len(batch)
+    conn.executemany(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+        [("header", json.dumps(header)), ("version", "0"), ("generation", str(generation)),
+         ("source_mtime", source)],
+    )
+    return row_no
+
+def import_csv(csv_path, path=None):
+    # (Re)builds the database from a CSV unless it already holds this version
+    # of the file. Returns the database path.
+    path = path or db_path_for(csv_path)
+    source = str(os.stat(csv_path).st_mtime_ns)
+    conn = _connect(path)
+    if _meta(conn).get("source_mtime") == source:
+        return path
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        with conn:
+            _replace_rows(conn, header, reader, source)
+    return path
+
+def import_upload(stream, path, max_bytes=None):
+    # Validates an uploaded CSV while it streams into the database, a batch at
+    # a time, so memory does not grow with the file. Bad rows are skipped and
+    # reported; a bad header or an oversized file leaves the old contents alone.
+    text = io.TextIOWrapper(io.BufferedReader(_CappedReader(stream, max_bytes), 1 << 16),
+                            encoding="utf-8-sig", newline="")
+    reader = csv.reader(text)
+    header = [column.strip() for column in next(reader, [])]
+    check_header(header)
+    at = {column: i for i, column in enumerate(header)}
+    report = {"rows": 0, "imported": 0, "rejected": 0, "rejects": [], "duplicate_ids": 0}
+
+    def accepted():
+        for row in reader:
+            if not any(field.strip() for field in row):
+                continue
+            report["rows"] += 1
+            errors = validate_row(row, at)
+            if errors:
+                report["rejected"] += 1
+                if len(report["rejects"]) < MAX_REPORTED_REJECTS:
+                    report["rejects"].append({"line": reader.line_num, "errors": errors})
+                continue
+            yield row
+
+    conn = _connect(path)
+    with conn:
+        report["imported"] = _replace_rows(conn, header, accepted(), "")
+        report["duplicate_ids"] = conn.execute(
+            "SELECT COUNT(*) FROM (SELECT 1 FROM patients GROUP BY patient_key HAVING COUNT(*) > 1)"
+        ).fetchone()[0]
+    report["bytes"] = text.buffer.raw.count
+    return report
+
+def stamp(path):
+    # (generation, version) of the database's current contents.
+    meta = _meta(_connect(path))
+    return int(meta.get("generation", 0)), int(meta.get("version", 0))
+
+def header(path):
+    return json.loads(_meta(_connect(path)).get("header", "[]"))
+
+def read_all(path):
+    # (header, rows, row versions, generation, version), read in one snapshot.
+    conn = _connect(path)
+    with conn:
+        conn.execute("BEGIN")
+        meta = _meta(conn)
+        cursor = conn.execute("SELECT data, version FROM patients ORDER BY row_no")
+        rows, versions = [], []
+        for data, version in cursor:
+            rows.append(json.loads(data))
+            versions.append(version)
+    return (json.loads(meta.get("header", "[]")), rows, versions,
+            int(meta.get("generation", 0)), int(meta.get("version", 0)))
+
+def changes_since(path, since):
+    # [(row_no, row, row version)] changed after version `since`, oldest change first.
+    return [
+        (row_no, json.loads(data), version)
+        for row_no, data, version in _connect(path).execute(
+            "SELECT row_no, data, version FROM patients WHERE version > ? ORDER BY version", (since,)
+        )
+    ]
+
+def _apply(conn, columns, values, version, expected_version=None):
+    # Applies one partial row inside the caller's transaction, stamping a
+    # changed row with `version`. Values must be strings that pass the upload
+    # checks; a row with any that don't is left alone and reported.
+    patient_id = patient_id_of(values)
+    if patient_id is None:
+        return {"error": "Missing patient ID"}
+    values = {**values, ID_COLUMN: patient_id}
+    for column in columns:
+        if column in values and not isinstance(values[column], str):
+            return {"error": f"{column} must be a string"}
+    found = conn.execute(
+        "SELECT row_no, data, version FROM patients WHERE patient_key = ? ORDER BY row_no LIMIT 1",
+        (patient_key(patient_id),),
+    ).fetchone()
+    if found is None:
+        return {"found": False}
+    row_no, data, row_version = found
+    if expected_version is not None and int(expected_version) != row_version:
+        return {"found": True, "conflict": True, "version": row_version}
+    row = pad(json.loads(data), len(columns))
+    changes = []
+    for i, column in enumerate(columns):
+        if column in values:
+            old_value = row[i].strip()
+            new_value = values[column].strip()
+            if old_value != new_value:
+                row[i] = new_value
+                changes.append((column, old_value, new_value))
+    # Only changed fields are checked, so rows imported before validation
+    # existed can still be edited.
+    errors = [error for error in (validate_field(column, new) for column, _, new in changes) if error]
+    if errors:
+        return {"error": "; ".join(errors)}
+    if changes:
+        row_version = version
+        conn.execute(
+            "UPDATE patients SET data = ?, patient_key = ?, version = ? WHERE row_no = ?",
+            (json.dumps(row), patient_key(row[columns.index(ID_COLUMN)]), row_version, row_no),
+        )
+    return {"found": True, "conflict": False, "changes": changes, "version": row_version}
+
+def update_rows(path, updates):
+    # Applies partial rows ({"Patient ID": ..., column: value, optional
+    # "_version"}) in one write transaction and one version bump. Returns a
+    # result per update, in order; rows that are invalid ({"error": ...}),
+    # missing or conflicting are skipped without affecting the others.
+    conn = _connect(path)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        meta = _meta(conn)
+        columns = json.loads(meta["header"])
+        version = int(meta.get("version", 0)) + 1
+        results = [_apply(conn, columns, values, version, values.get("_version")) for values in updates]
+        if any(result.get("changes") for result in results):
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (str(version),))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return results
+
+def update_row(path, patient_id, values, expected_version=None):
+    # Single-patient form of update_rows. With expected_version, a row changed
+    # since the caller read it is left alone and reported as a conflict.
+    return update_rows(path, [{**values, ID_COLUMN: patient_id, "_version": expected_version}])[0]
+
+def iter_csv(path, batch_size=1000):
+    # CSV export, produced in chunks so large files are streamed.
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(header(path))
+    cursor = _connect(path).execute("SELECT data FROM patients ORDER BY row_no")
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        writer.writerows(json.loads(data) for (data,) in batch)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
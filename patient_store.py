@@ -0,0 +1,270 @@
+# patient_store.py
+
+import base64
+import bisect
+import csv
+import json
+import os
+import threading
+from array import array
+from collections import OrderedDict
+import numpy as np
+import patient_db
+
+MAX_TABLES = 8
+PAGE_SIZE = 100
+
+# Sort orders offered by PatientTable.query besides file order ("row").
+SORT_COLUMNS = {"name": "Patient name", "id": "Patient ID", "cancer": "Cancer type", "country": "Country"}
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class PatientTable:
+    # An uploaded patient file held column-wise. Each column is a list in which
+    # repeated values share one string object, so low-cardinality columns
+    # (cancer type, stages, ...) cost a pointer per row.
+    #
+    # A cached table is shared by every request and updated in place, so
+    # updates and reads hold self.lock: a reader sees a table either before or
+    # after a batch of row updates, never part way through one.
+    __slots__ = ("header", "columns", "versions", "generation", "version",
+                 "by_id", "names", "name_codes", "name_rows", "trigrams", "_derived", "lock")
+
+    def __init__(self, header, rows, versions=None, generation=None, version=None):
+        self.header = header
+        width = len(header)
+        rows = [patient_db.pad(row, width) for row in rows]
+        self.columns = []
+        for values in zip(*rows) if rows else [()] * width:
+            pool = {}
+            self.columns.append([pool.setdefault(v, v) for v in values])
+        self.versions = array("q", versions) if versions is not None else None
+        self.generation = generation
+        self.version = version
+        self.by_id = {}
+        for i, patient_id in enumerate(self.column("Patient ID")):
+            self.by_id.setdefault(patient_id.strip().lower(), i)
+        self.names = []
+        self.name_codes = {}
+        self.name_rows = []
+        self.trigrams = {}
+        for i, name in enumerate(self.column("Patient name")):
+            self.name_rows[self._name_code(name)].append(i)
+        # Value indexes and sort orders, built on first use and dropped on any update.
+        self._derived = {}
+        self.lock = threading.RLock()
+
+    def _name_code(self, name):
+        # Distinct lower-cased names get a code, a row list and trigram postings.
+        key = name.strip().lower()
+        code = self.name_codes.get(key)
+        if code is None:
+            code = self.name_codes[key] = len(self.names)
+            self.names.append(key)
+            self.name_rows.append(array("I"))
+            for gram in _trigrams(key):
+                self.trigrams.setdefault(gram, array("I")).append(code)
+        return code
+
+    def update_row(self, i, row, version=None):
+        # Applies one changed row in place, keeping the indexes in step.
+        with self.lock:
+            self._derived = {}
+            old_id = self.column("Patient ID")[i].strip().lower() if "Patient ID" in self.header else ""
+            old_name = self.column("Patient name")[i] if "Patient name" in self.header else ""
+            for column, value in zip(self.columns, patient_db.pad(row, len(self.header))):
+                column[i] = value
+            if self.versions is not None and version is not None:
+                self.versions[i] = version
+            if "Patient ID" in self.header:
+                new_id = self.column("Patient ID")[i].strip().lower()
+                if new_id != old_id:
+                    if self.by_id.get(old_id) == i:
+                        del self.by_id[old_id]
+                    self.by_id.setdefault(new_id, i)
+            if "Patient name" in self.header:
+                new_name = self.column("Patient name")[i]
+                if new_name.strip().lower() != old_name.strip().lower():
+                    self.name_rows[self._name_code(old_name)].remove(i)
+                    self.name_rows[self._name_code(new_name)].append(i)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def column(self, name):
+        try:
+            return self.columns[self.header.index(name)]
+        except ValueError:
+            return ("",) * len(self)
+
+    def row(self, i):
+        with self.lock:
+            return {name: column[i] for name, column in zip(self.header, self.columns)}
+
+    def get(self, patient_id):
+        return self.get_with_version(patient_id)[0]
+
+    def version_of(self, patient_id):
+        return self.get_with_version(patient_id)[1]
+
+    def get_with_version(self, patient_id):
+        # (row, row version) read together, or (None, None).
+        with self.lock:
+            i = self.by_id.get(patient_id.strip().lower())
+            if i is None:
+                return None, None
+            return self.row(i), None if self.versions is None else self.versions[i]
+
+    def search(self, term):
+        # Rows whose name contains term (case-insensitive), in file order.
+        with self.lock:
+            term = term.strip().lower()
+            if not term:
+                return range(len(self))
+            if len(term) < 3:
+                candidates = range(len(self.names))
+            else:
+                postings = sorted((self.trigrams.get(gram, ()) for gram in _trigrams(term)), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            rows = []
+            for code in candidates:
+                if term in self.names[code]:
+                    rows.extend(self.name_rows[code])
+            return sorted(rows)
+
+    def rows_with(self, column, value):
+        # Rows whose column equals value, ignoring case and surrounding spaces.
+        with self.lock:
+            index = self._derived.get(("values", column))
+            if index is None:
+                groups = {}
+                for i, v in enumerate(self.column(column)):
+                    groups.setdefault(v.strip().lower(), array("I")).append(i)
+                index = self._derived[("values", column)] = {v: np.frombuffer(rows, dtype=np.uint32)
+                                                             for v, rows in groups.items()}
+            return index.get(value.strip().lower(), np.empty(0, dtype=np.uint32))
+
+    def sorted_rows(self, sort):
+        # (rows in sort order, their sort keys); ties keep file order.
+        with self.lock:
+            order = self._derived.get(("order", sort))
+            if order is None:
+                if sort == "row":
+                    order = (np.arange(len(self)), None)
+                else:
+                    keys = [v.strip().lower() for v in self.column(SORT_COLUMNS[sort])]
+                    rows = sorted(range(len(self)), key=keys.__getitem__)
+                    order = (np.array(rows, dtype=np.int64), [keys[i] for i in rows])
+                self._derived[("order", sort)] = order
+            return order
+
+    def query(self, q="", cancer="", country="", sort="row", cursor=None, offset=0, limit=PAGE_SIZE):
+        # One page of patients matching every given filter, in sort order.
+        # Pages continue from a cursor (the last patient's sort key and row) or,
+        # without one, from an offset into the matches.
+        with self.lock:
+            mask = np.ones(len(self), dtype=bool)
+            if q.strip():
+                mask[:] = False
+                mask[list(self.search(q))] = True
+            for column, value in (("Cancer type", cancer), ("Country", country)):
+                if value.strip():
+                    matching = np.zeros(len(self), dtype=bool)
+                    matching[self.rows_with(column, value)] = True
+                    mask &= matching
+            rows, keys = self.sorted_rows(sort)
+            start = 0
+            if cursor is not None:
+                key, last_row = cursor
+                if keys is None:
+                    start = int(np.searchsorted(rows, last_row, side="right"))
+                else:
+                    lo, hi = bisect.bisect_left(keys, key), bisect.bisect_right(keys, key)
+                    start = lo + int(np.searchsorted(rows[lo:hi], last_row, side="right"))
+            hits = rows[start:][mask[rows[start:]]]
+            page = hits[offset if cursor is None else 0:][:limit]
+            next_cursor = None
+            if len(page) and page[-1] != hits[-1]:
+                last = int(page[-1])
+                next_cursor = encode_cursor(None if keys is None else self.column(SORT_COLUMNS[sort])[last].strip().lower(),
+                                            last)
+            return {"total": int(mask.sum()), "patients": self.summaries(page.tolist()), "next_cursor": next_cursor}
+
+    def summaries(self, rows=None):
+        with self.lock:
+            ids, names, cancers = self.column("Patient ID"), self.column("Patient name"), self.column("Cancer type")
+            return [
+                {"name": names[i].strip(), "cancer": cancers[i].strip(), "id": ids[i].strip()}
+                for i in (range(len(self)) if rows is None else rows)
+            ]
+
+def encode_cursor(key, row):
+    return base64.urlsafe_b64encode(json.dumps([key, row]).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    # ValueError for anything encode_cursor could not have produced.
+    value = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    if not isinstance(value, list) or len(value) != 2:
+        raise ValueError("Invalid cursor")
+    key, row = value
+    if not (key is None or isinstance(key, str)) or not isinstance(row, int) or isinstance(row, bool):
+        raise ValueError("Invalid cursor")
+    return key, row
+
+def read_table(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        return PatientTable(header, list(reader))
+
+def read_db_table(path):
+    header, rows, versions, generation, version = patient_db.read_all(path)
+    return PatientTable(header, rows, versions, generation, version)
+
+_tables = OrderedDict()  # CSV: (path, mtime, size) -> table; patient db: path -> table
+_lock = threading.Lock()
+
+def _load_db(path):
+    # Patient databases are read once per import; later row updates are
+    # applied to the cached table from the database's change versions.
+    path = os.path.abspath(path)
+    generation, version = patient_db.stamp(path)
+    with _lock:
+        table = _tables.get(path)
+        if table is not None and table.generation == generation:
+            if table.version < version:
+                with table.lock:
+                    for row_no, row, row_version in patient_db.changes_since(path, table.version):
+                        table.update_row(row_no, row, row_version)
+                        version = max(version, row_version)
+                    table.version = version
+            _tables.move_to_end(path)
+            return table
+    table = read_db_table(path)
+    with _lock:
+        _tables[path] = table
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+    return table
+
+def load(path):
+    if patient_db.is_patient_db(path):
+        return _load_db(path)
+    # A CSV is parsed once per version of the file; an edit (new mtime) replaces the old table.
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        table = _tables.get(key)
+        if table is not None:
+            _tables.move_to_end(key)
+            return table
+    table = read_table(path)
+    with _lock:
+        for stale in [k for k in _tables if isinstance(k, tuple) and k[0] == path]:
+            del _tables[stale]
+        _tables[key] = table
+        while len(_tables) > MAX_TABLES:
+            _tables.popitem(last=False)
+    return table
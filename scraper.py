@@ -1,11 +1,22 @@
 # scraper.py
 
-import requests
 import csv
+import hashlib
+import io
+import json
 import os
 import re
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from bs4 import BeautifulSoup, SoupStrainer
+from urllib.parse import urljoin, urlparse
+import http_client
+import file_lock
+import metrics
+import catalogue
+import eligibility_cache
+from patient_creation_4 import EU_COUNTRIES
 
 CANCER_URLS = {
     "Breast": "https://www.cancertrials.ie/current-trials/breast/",
@@ -23,6 +34,103 @@ API_QUERY_MAP = {
     "CLL": "Chronic Lymphocytic Leukemia"
 }
 
+# Upper bound on trial pages being worked on at once, and on concurrent
+# requests to any single host (cancertrials.ie, clinicaltrials.gov).
+MAX_IN_FLIGHT = 8
+PER_HOST_LIMIT = 4
+
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+_local = threading.local()
+
+@contextmanager
+def host_slot(url, limit=PER_HOST_LIMIT):
+    host = urlparse(url).netloc
+    with _host_slots_lock:
+        slot = _host_slots.get((host, limit))
+        if slot is None:
+            slot = _host_slots[(host, limit)] = threading.BoundedSemaphore(limit)
+    with slot:
+        yield
+
+# Stage labels of scraper_stage_duration_seconds for each kind of request.
+FETCH_STAGES = {"listing": "listing_fetch", "trial_page": "page_fetch"}
+
+def fetch(url, **kwargs):
+    with host_slot(url, getattr(_local, "per_host_limit", PER_HOST_LIMIT)):
+        with metrics.span("scraper_stage_duration_seconds", stage=FETCH_STAGES.get(kwargs.get("url_class"), "api_call")):
+            return http_client.get(url, **kwargs)
+
+# lxml builds the same tree several times faster; html.parser is the fallback.
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+# Only the parts of a page the scraper reads become tree nodes; the navigation,
+# sidebars, scripts and footers around them are tokenized and thrown away.
+# Both kinds of page keep the whole .inside-article content container, so
+# selectors over it ('h2 + a.btn-login') see the real siblings. Listing pages
+# also keep the next link. The patterns see the whole class attribute while
+# parsing, not each class.
+TRIAL_PAGE_PARTS = SoupStrainer(class_=re.compile(r"(^|\s)inside-article(\s|$)"))
+LISTING_PARTS = SoupStrainer(class_=re.compile(r"(^|\s)(inside-article|next)(\s|$)"))
+
+def response_charset(response):
+    # The charset the server declared, if any. requests falls back to
+    # ISO-8859-1 for text/html without one; leaving it out instead lets the
+    # parser use the page's own <meta charset> or sniff the bytes.
+    for param in response.headers.get("Content-Type", "").split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key.lower() == "charset":
+            return value.strip("\"' ") or None
+    return None
+
+def parse_html(response, parse_only=None):
+    # Parses the raw body rather than response.text, which would decode the
+    # whole page to str first.
+    with metrics.span("scraper_stage_duration_seconds", stage="html_parse"):
+        return BeautifulSoup(response.content, HTML_PARSER, parse_only=parse_only,
+                             from_encoding=response_charset(response))
+
+def read_listing(soup):
+    # (trial page links, next listing page or None) from a listing page.
+    links = [a['href'] for a in soup.select('.inside-article a.btn-login.btn-xs')]
+    next_button = soup.select_one('a.next.page-numbers')
+    return links, next_button['href'] if next_button else None
+
+def read_trial_tables(soup):
+    # (display name, file-safe name, table rows) from a trial page, or None
+    # when it has no detail tables.
+    tables = soup.select('table.table')
+    if not tables:
+        return None
+
+    name = "Unnamed Trial"
+    trial_name = "Unknown_Trial"
+    all_data = []
+
+    for table in tables:
+        for row in table.find_all("tr"):
+            cols = [col.get_text(" ", strip=True) for col in row.find_all(["td", "th"])]
+            if cols and "Name:" in cols[0]:
+                name = cols[1]
+                trial_name = sanitize_filename(cols[1])
+            all_data.append(cols)
+        all_data.append(["-" * 50])
+    return name, trial_name, all_data
+
+def _with_host_limit(per_host_limit, http_stats, func, *args):
+    # Runs func on a pool thread under the scrape's host limit, counting its
+    # connections into the scrape's http_stats.
+    _local.per_host_limit = per_host_limit
+    try:
+        with http_client.track(http_stats):
+            return func(*args)
+    finally:
+        del _local.per_host_limit
+
 def sanitize_filename(name):
     return "".join(c if c.isalnum() or c == "-" else "_" for c in name)
 
@@ -37,40 +145,45 @@ def extract_participation_criteria_link(detailed_url):
     return f"{detailed_url}#participation-criteria" if detailed_url != "n/a" else "n/a"
 
 def extract_eligibility_from_api(nct_id):
+    return fetch_study_eligibility(nct_id)[0]
+
+def fetch_study_eligibility(nct_id):
+    # (eligibility text, lastUpdatePostDate) from the one full study record;
+    # the date goes into the manifest without another request.
     if not nct_id:
-        return "Error"  # Explicitly handle 
+        return "Error", None  # Explicitly handle 
 
     api_url = f"https://clinicaltrials.gov/api/v2/studies/{nct_id}"
     try:
-        response = requests.get(api_url, timeout=10)
+        response = fetch(api_url, url_class="study", timeout=10)
         response.raise_for_status()
         data = response.json()
         eligibility = data.get("protocolSection", {}).get("eligibilityModule", {}).get("eligibilityCriteria")
-        return eligibility if eligibility else "n/a"
+        return (eligibility if eligibility else "n/a"), study_last_update(data)
     except Exception:
-        return "Error"
+        return "Error", None
 
 def extract_nct_id_from_url(url):
     match = re.search(r"(NCT\d+)", url)
     return match.group(1) if match else None
 
+def make_record(name, nct_id, link, eligibility, exclusion_count, status="RECRUITING", filename=None):
+    return {
+        "name": name,
+        "nct_id": nct_id,
+        "link": link,
+        "eligibility": eligibility,
+        "exclusion_count": exclusion_count,
+        "status": status,
+        "filename": filename
+    }
+
 def extract_trial_data(url, country, cancer_type):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    tables = soup.select('table.table')
-    if not tables:
+    soup = parse_html(fetch(url, url_class="trial_page"), TRIAL_PAGE_PARTS)
+    trial = read_trial_tables(soup)
+    if trial is None:
         return None
-
-    trial_name = "Unknown_Trial"
-    all_data = []
-
-    for table in tables:
-        for row in table.find_all("tr"):
-            cols = [col.get_text(" ", strip=True) for col in row.find_all(["td", "th"])]
-            if cols and "Name:" in cols[0]:
-                trial_name = sanitize_filename(cols[1])
-            all_data.append(cols)
-        all_data.append(["-" * 50])
+    _, trial_name, all_data = trial
 
     detailed_info_link = extract_detailed_info_link(soup, url)
     participation_criteria_link = extract_participation_criteria_link(detailed_info_link)
@@ -86,38 +199,162 @@ def extract_trial_data(url, country, cancer_type):
     os.makedirs(cancer_dir, exist_ok=True)
     filename = os.path.join(cancer_dir, f"{trial_name}.csv")
 
-    with open(filename, mode="w", newline="", encoding="utf-8") as file:
-        writer = csv.writer(file)
-        writer.writerows(all_data)
+    write_trial_rows(filename, all_data)
 
     return filename
 
 def get_all_trial_links(base_url):
     current_page = base_url
     links = []
-    while current_page:
-        soup = BeautifulSoup(requests.get(current_page).text, 'html.parser')
-        links += [a['href'] for a in soup.select('.inside-article a.btn-login.btn-xs')]
-        next_button = soup.select_one('a.next.page-numbers')
-        current_page = next_button['href'] if next_button else None
+    with metrics.span("scraper_stage_duration_seconds", stage="listing_pagination"):
+        while current_page:
+            soup = parse_html(fetch(current_page, url_class="listing"), LISTING_PARTS)
+            page_links, current_page = read_listing(soup)
+            links += page_links
     return links
 
-def fetch_eu_trials(cancer_type, country):
+# The v2 API caps pageSize at 1000. Only the modules extract_trial_data_in_eu
+# reads are requested, which keeps each page a fraction of the full record.
+API_PAGE_SIZE = 1000
+API_FIELDS = ",".join([
+    "IdentificationModule",
+    "StatusModule",
+    "SponsorCollaboratorsModule",
+    "DesignModule",
+    "EligibilityModule",
+])
+
+def iter_eu_trial_pages(cancer_type, country, fields=API_FIELDS, extra_params=None, raise_errors=False):
     url = "https://clinicaltrials.gov/api/v2/studies"
     headers = {"Accept": "application/json"}
     params = {
         "query.cond": API_QUERY_MAP.get(cancer_type, cancer_type),
         "query.locn": country,
         "filter.overallStatus": "RECRUITING|NOT_YET_RECRUITING",
-        "pageSize": 50
+        "pageSize": API_PAGE_SIZE,
+        "fields": fields
     }
+    params.update(extra_params or {})
+    while True:
+        try:
+            response = fetch(url, url_class="search", params=params, headers=headers)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"API error for {cancer_type} in {country}: {e}")
+            return
+        studies = data.get("studies", [])
+        if studies:
+            yield studies
+        next_token = data.get("nextPageToken")
+        if not next_token:
+            return
+        params["pageToken"] = next_token
+
+def fetch_eu_trials(cancer_type, country):
+    return [study for page in iter_eu_trial_pages(cancer_type, country) for study in page]
+
+# Incremental refreshes keep one manifest per trials_data/<country>/<cancer>/
+# directory: key -> NCT ID, file, content hash, lastUpdatePostDate and
+# exclusion count. EU entries are keyed by NCT ID, Irish ones by trial page URL.
+MANIFEST_NAME = "_manifest.json"
+LIGHT_FIELDS = "NCTId,LastUpdatePostDate"
+IDS_PER_REQUEST = 100
+
+def load_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
     try:
-        response = requests.get(url, params=params, headers=headers)
-        response.raise_for_status()
-        return response.json().get("studies", [])
-    except Exception as e:
-        print(f"API error for {cancer_type} in {country}: {e}")
-        return []
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+def save_manifest(directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    with metrics.span("scraper_stage_duration_seconds", stage="file_write"):
+        file_lock.replace_file(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+
+def rows_hash(rows):
+    return hashlib.sha256(json.dumps(rows, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def is_unchanged(entry, last_update, directory):
+    return bool(
+        entry
+        and last_update
+        and entry.get("last_update") == last_update
+        and os.path.exists(os.path.join(directory, entry["filename"]))
+    )
+
+def write_trial_rows(filename, rows):
+    # Written whole and renamed into place; another worker may be reading it.
+    with metrics.span("scraper_stage_duration_seconds", stage="file_write"):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        file_lock.replace_file(filename, buf.getvalue())
+
+def remove_stale_trials(directory, manifest, live_keys):
+    removed = 0
+    for key in [k for k in manifest if k not in live_keys]:
+        path = os.path.join(directory, manifest.pop(key)["filename"])
+        if os.path.exists(path):
+            os.remove(path)
+        removed += 1
+    return removed
+
+def nct_id_of(study):
+    return study.get("protocolSection", {}).get("identificationModule", {}).get("nctId")
+
+def study_last_update(study):
+    status_mod = study.get("protocolSection", {}).get("statusModule", {})
+    return status_mod.get("lastUpdatePostDateStruct", {}).get("date")
+
+def fetch_last_updates(nct_ids):
+    # One light request per IDS_PER_REQUEST studies instead of a full record each.
+    url = "https://clinicaltrials.gov/api/v2/studies"
+    nct_ids = sorted(set(filter(None, nct_ids)))
+    last_updates = {}
+    for start in range(0, len(nct_ids), IDS_PER_REQUEST):
+        params = {
+            "filter.ids": ",".join(nct_ids[start:start + IDS_PER_REQUEST]),
+            "fields": LIGHT_FIELDS,
+            "pageSize": API_PAGE_SIZE
+        }
+        while True:
+            try:
+                response = fetch(url, params=params, headers={"Accept": "application/json"}, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+            except Exception as e:
+                print(f"API error fetching update dates: {e}")
+                break
+            for study in data.get("studies", []):
+                last_updates[nct_id_of(study)] = study_last_update(study)
+            if not data.get("nextPageToken"):
+                break
+            params["pageToken"] = data["nextPageToken"]
+    return last_updates
+
+def print_sync_counts(cancer_type, country, counts):
+    print(
+        f"{cancer_type} in {country}: {counts['added']} added, {counts['changed']} changed, "
+        f"{counts['removed']} removed, {counts['unchanged']} unchanged"
+    )
+
+EXCLUSION_HEADER = r"(?i)(?:Key )?Exclusion(?: Criteria)?[:\n]"
+
+def split_eligibility(eligibility_text):
+    # Same section boundary as count_exclusions. Returns (inclusion, exclusion).
+    if not eligibility_text or eligibility_text.lower().strip() in {"n/a", "na", "error"}:
+        return "", ""
+    eligibility_text = eligibility_text.replace("\r\n", "\n").replace("\r", "\n")
+    eligibility_text = re.sub(r"(?i)^\s*Eligibility Criteria:\s*", "", eligibility_text)
+    sections = re.split(EXCLUSION_HEADER, eligibility_text)
+    inclusion = re.sub(r"(?i)^\s*(?:Key )?Inclusion(?: Criteria)?:?\s*", "", sections[0]).strip()
+    return inclusion, "\n".join(sections[1:]).strip()
 
 def count_exclusions(eligibility_text):
     if not eligibility_text or eligibility_text.lower().strip() in {"n/a", "na", "error"}:
@@ -126,7 +363,7 @@ def count_exclusions(eligibility_text):
     eligibility_text = eligibility_text.replace("\r\n", "\n").replace("\r", "\n")
 
     # Spliting by known exclusion patterns
-    sections = re.split(r"(?i)(?:Key )?Exclusion(?: Criteria)?[:\n]", eligibility_text)
+    sections = re.split(EXCLUSION_HEADER, eligibility_text)
 
     # If no exclusion section found → treat as inclusion-only → sort highest priority
     if len(sections) < 2:
@@ -139,125 +376,303 @@ def count_exclusions(eligibility_text):
 
     return len(bullet_matches) if bullet_matches else float("inf")
 
-def extract_trial_data_in_eu(cancer_type, country, output_dir):
-    trials = fetch_eu_trials(cancer_type, country)
-    if not trials:
-        print(f"No trials found for {cancer_type} in {country}")
-        return []
+def eu_trial_rows(trial, idx):
+    ps = trial.get("protocolSection", {})
+    id_mod = ps.get("identificationModule", {})
+    status_mod = ps.get("statusModule", {})
+    sponsor_mod = ps.get("sponsorCollaboratorsModule", {})
+    design_mod = ps.get("designModule", {})
+    eligibility = ps.get("eligibilityModule", {}).get("eligibilityCriteria", "n/a")
+
+    nct_id = id_mod.get("nctId", f"trial{idx}")
+    title = id_mod.get("briefTitle", "n/a")
+
+    rows = [
+        ["Name:", title],
+        ["Number:", str(idx)],
+        ["Full Title:", id_mod.get("officialTitle", "n/a")],
+        ["-" * 50],
+        ["Type:", design_mod.get("studyType", "n/a")],
+        ["Sponsor:", sponsor_mod.get("leadSponsor", {}).get("name", "n/a")],
+        ["Recruitment Started:", f"Global: {status_mod.get('startDateStruct', {}).get('date', 'n/a')}"],
+        ["-" * 50],
+        ["More Detailed Information:", f"https://clinicaltrials.gov/study/{nct_id}"],
+        ["Participation Criteria Link:", f"https://clinicaltrials.gov/study/{nct_id}#participation-criteria"],
+        ["Eligibility Criteria:", f"Eligibility Criteria: {eligibility}"]
+    ]
+    record = make_record(title, nct_id, f"https://clinicaltrials.gov/study/{nct_id}", eligibility,
+                         count_exclusions(eligibility), status_mod.get("overallStatus", "RECRUITING"))
+    return record, rows
+
+def plan_eu_refresh(cancer_type, country, manifest, cancer_dir):
+    # Light pass: NCT ID and lastUpdatePostDate for everything still
+    # recruiting. Returns {nct_id: (position, last_update)}, the IDs that need a
+    # full fetch, and the stored records of the trials that can be left alone.
+    listing = {}
+    for page in iter_eu_trial_pages(cancer_type, country, fields=LIGHT_FIELDS, raise_errors=True):
+        for study in page:
+            nct_id = nct_id_of(study)
+            if nct_id:
+                listing[nct_id] = (len(listing) + 1, study_last_update(study))
+
+    changed_ids = []
+    unchanged_records = []
+    for nct_id, (_, last_update) in listing.items():
+        entry = manifest.get(nct_id)
+        if is_unchanged(entry, last_update, cancer_dir):
+            unchanged_records.append(manifest_record(entry, cancer_dir))
+        else:
+            changed_ids.append(nct_id)
+    return listing, changed_ids, unchanged_records
+
+def iter_eu_trials_by_id(cancer_type, country, nct_ids):
+    for start in range(0, len(nct_ids), IDS_PER_REQUEST):
+        batch = {"filter.ids": ",".join(nct_ids[start:start + IDS_PER_REQUEST])}
+        for page in iter_eu_trial_pages(cancer_type, country, extra_params=batch, raise_errors=True):
+            yield from page
+
+def manifest_entry(record, content_hash, last_update):
+    return {
+        "nct_id": record["nct_id"],
+        "filename": os.path.basename(record["filename"]),
+        "hash": content_hash,
+        "last_update": last_update,
+        "exclusion_count": record["exclusion_count"],
+        "status": record["status"],
+        "name": record["name"],
+        "link": record["link"],
+        "eligibility": record["eligibility"]
+    }
 
+def manifest_record(entry, directory):
+    return make_record(
+        entry.get("name", "Unnamed Trial"),
+        entry.get("nct_id"),
+        entry.get("link", "#"),
+        entry.get("eligibility", "N/A"),
+        entry["exclusion_count"],
+        entry.get("status", "RECRUITING"),
+        os.path.join(directory, entry["filename"])
+    )
+
+def extract_trial_data_in_eu(cancer_type, country, output_dir, incremental=False, stats=None, on_trial=None,
+                             write_csv=True):
     cancer_dir = os.path.join(output_dir, cancer_type.lower().replace(" ", "_"))
-    os.makedirs(cancer_dir, exist_ok=True)
+    manifest = load_manifest(cancer_dir) if write_csv else {}
+    counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
 
-    trial_entries = []
-    for idx, trial in enumerate(trials, 1):
-        ps = trial.get("protocolSection", {})
-        id_mod = ps.get("identificationModule", {})
-        status_mod = ps.get("statusModule", {})
-        sponsor_mod = ps.get("sponsorCollaboratorsModule", {})
-        design_mod = ps.get("designModule", {})
-        eligibility = ps.get("eligibilityModule", {}).get("eligibilityCriteria", "n/a")
-
-        nct_id = id_mod.get("nctId", f"trial{idx}")
-        title = id_mod.get("briefTitle", "n/a")
-        exclusion_count = count_exclusions(eligibility)
-
-        rows = [
-            ["Name:", title],
-            ["Number:", str(idx)],
-            ["Full Title:", id_mod.get("officialTitle", "n/a")],
-            ["-" * 50],
-            ["Type:", design_mod.get("studyType", "n/a")],
-            ["Sponsor:", sponsor_mod.get("leadSponsor", {}).get("name", "n/a")],
-            ["Recruitment Started:", f"Global: {status_mod.get('startDateStruct', {}).get('date', 'n/a')}"],
-            ["-" * 50],
-            ["More Detailed Information:", f"https://clinicaltrials.gov/study/{nct_id}"],
-            ["Participation Criteria Link:", f"https://clinicaltrials.gov/study/{nct_id}#participation-criteria"],
-            ["Eligibility Criteria:", f"Eligibility Criteria: {eligibility}"]
-        ]
-
-        filename = os.path.join(cancer_dir, f"{sanitize_filename(nct_id)}.csv")
-        trial_entries.append({
-            "rows": rows,
-            "filename": filename,
-            "exclusion_count": exclusion_count
-        })
-
-    trial_entries.sort(key=lambda t: t["exclusion_count"])
-    for i, entry in enumerate(trial_entries, 1):
-        with open(entry["filename"], mode="w", newline="", encoding="utf-8") as f:
-            csv.writer(f).writerows(entry["rows"])
-        print(f"{i}. {os.path.basename(entry['filename'])} — Exclusions: {entry['exclusion_count']}")
-
-    return [entry["filename"] for entry in trial_entries]
-
-def scrape_trials(cancer_type, country="Ireland"):
-    if country == "Ireland":
-        # Normalize input to match keys in CANCER_URLS
-        cancer_type = cancer_type.strip().title()
+    # Each trial is written out as soon as its page arrives; only its record
+    # is kept around for the final ordering.
+    try:
+        if incremental:
+            listing, changed_ids, records = plan_eu_refresh(cancer_type, country, manifest, cancer_dir)
+            counts["unchanged"] = len(records)
+            studies = (
+                (listing[nct_id_of(study)][0], study)
+                for study in iter_eu_trials_by_id(cancer_type, country, changed_ids)
+                if nct_id_of(study) in listing
+            )
+        else:
+            records = []
+            studies = enumerate((study for page in iter_eu_trial_pages(cancer_type, country) for study in page), 1)
+
+        for idx, trial in studies:
+            record, rows = eu_trial_rows(trial, idx)
+            if write_csv:
+                os.makedirs(cancer_dir, exist_ok=True)
+                record["filename"] = os.path.join(cancer_dir, f"{sanitize_filename(record['nct_id'])}.csv")
+
+                # The Number row is just the position in the API listing, so it
+                # is left out of the hash to avoid rewrites when the order shifts.
+                content_hash = rows_hash([row for row in rows if row[0] != "Number:"])
+                entry = manifest.get(record["nct_id"])
+                if incremental and entry and entry.get("hash") == content_hash and os.path.exists(record["filename"]):
+                    counts["unchanged"] += 1
+                else:
+                    write_trial_rows(record["filename"], rows)
+                    counts["changed" if entry else "added"] += 1
+                manifest[record["nct_id"]] = manifest_entry(record, content_hash, study_last_update(trial))
+            records.append(record)
+            if on_trial:
+                on_trial(record)
+    except Exception as e:
+        print(f"Error refreshing {cancer_type} in {country}: {e}")
+        return []
 
-        base_url = CANCER_URLS.get(cancer_type)
-        if not base_url:
-            print(f"No URL found for cancer type: '{cancer_type}'.")
-            return []
+    if incremental:
+        counts["removed"] = remove_stale_trials(cancer_dir, manifest, listing)
+        print_sync_counts(cancer_type, country, counts)
+    if write_csv and os.path.isdir(cancer_dir):
+        save_manifest(cancer_dir, manifest)
+    if stats is not None:
+        stats.update(counts)
 
-        trial_links = get_all_trial_links(base_url)
-        trial_entries = []
+    if not records:
+        print(f"No trials found for {cancer_type} in {country}")
+        return []
 
-        for link in trial_links:
-            try:
-                response = requests.get(link)
-                soup = BeautifulSoup(response.text, 'html.parser')
+    records.sort(key=lambda t: t["exclusion_count"])
+    for i, record in enumerate(records, 1):
+        print(f"{i}. {record['nct_id']} — Exclusions: {record['exclusion_count']}")
 
-                tables = soup.select('table.table')
-                if not tables:
-                    continue
+    return records
 
-                trial_name = "Unknown_Trial"
-                all_data = []
+def scrape_irish_trial(link, country, cancer_type):
+    soup = parse_html(fetch(link, url_class="trial_page"), TRIAL_PAGE_PARTS)
+    trial = read_trial_tables(soup)
+    if trial is None:
+        return None
+    name, trial_name, all_data = trial
+
+    detailed_info_link = extract_detailed_info_link(soup, link)
+    participation_criteria_link = extract_participation_criteria_link(detailed_info_link)
+    nct_id = extract_nct_id_from_url(participation_criteria_link)
+    eligibility, last_update = fetch_study_eligibility(nct_id)
+
+    exclusion_count = count_exclusions(eligibility)
+
+    all_data.extend([
+        ["More Detailed Information:", detailed_info_link],
+        ["Participation Criteria Link:", participation_criteria_link],
+        ["Eligibility Criteria:", eligibility]
+    ])
 
-                for table in tables:
-                    for row in table.find_all("tr"):
-                        cols = [col.get_text(" ", strip=True) for col in row.find_all(["td", "th"])]
-                        if cols and "Name:" in cols[0]:
-                            trial_name = sanitize_filename(cols[1])
-                        all_data.append(cols)
-                    all_data.append(["-" * 50])
+    cancer_dir = os.path.join("trials_data", country.lower().replace(" ", "_"), cancer_type.lower().replace(" ", "_"))
+    filename = os.path.join(cancer_dir, f"{trial_name}.csv")
 
-                detailed_info_link = extract_detailed_info_link(soup, link)
-                participation_criteria_link = extract_participation_criteria_link(detailed_info_link)
-                nct_id = extract_nct_id_from_url(participation_criteria_link)
-                eligibility = extract_eligibility_from_api(nct_id)
+    return {
+        "link": link,
+        "rows": all_data,
+        "filename": filename,
+        "last_update": last_update,
+        "record": make_record(name, nct_id, detailed_info_link, eligibility, exclusion_count)
+    }
 
-                exclusion_count = count_exclusions(eligibility)
+def scrape_trials(cancer_type, country="Ireland", max_workers=MAX_IN_FLIGHT, per_host_limit=PER_HOST_LIMIT,
+                  incremental=False, stats=None, on_trial=None, write_csv=True):
+    # Returns trial records (see make_record) sorted by exclusion count. With
+    # write_csv the usual trials_data/<country>/<cancer>/ files are written too.
+    if incremental and not write_csv:
+        raise ValueError("Incremental refresh works on the CSV files, so it needs write_csv=True")
 
-                all_data.extend([
-                    ["More Detailed Information:", detailed_info_link],
-                    ["Participation Criteria Link:", participation_criteria_link],
-                    ["Eligibility Criteria:", eligibility]
-                ])
+    if country == "Ireland":
+        # Normalize input to match keys in CANCER_URLS
+        cancer_type = cancer_type.strip().title()
 
-                cancer_dir = os.path.join("trials_data", country.lower().replace(" ", "_"), cancer_type.lower().replace(" ", "_"))
-                os.makedirs(cancer_dir, exist_ok=True)
-                filename = os.path.join(cancer_dir, f"{trial_name}.csv")
+        base_url = CANCER_URLS.get(cancer_type)
+        if not base_url:
+            print(f"No URL found for cancer type: '{cancer_type}'.")
+            return []
 
-                trial_entries.append({
-                    "filename": filename,
-                    "rows": all_data,
-                    "exclusion_count": exclusion_count
-                })
+        cancer_dir = os.path.join("trials_data", country.lower().replace(" ", "_"), cancer_type.lower().replace(" ", "_"))
+        manifest = load_manifest(cancer_dir) if write_csv else {}
+        counts = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+
+        http_stats = http_client.new_stats()
+        with http_client.track(http_stats):
+            trial_links = get_all_trial_links(base_url)
+        results = [None] * len(trial_links)
+
+        # Incremental runs reuse the manifest entry of any trial whose study has
+        # not been updated since, without fetching its page or eligibility.
+        to_fetch = list(range(len(trial_links)))
+        if incremental:
+            with http_client.track(http_stats):
+                last_updates = fetch_last_updates(manifest[link].get("nct_id") for link in trial_links if link in manifest)
+            to_fetch = []
+            for i, link in enumerate(trial_links):
+                entry = manifest.get(link)
+                if entry and is_unchanged(entry, last_updates.get(entry.get("nct_id")), cancer_dir):
+                    results[i] = {"link": link, "record": manifest_record(entry, cancer_dir)}
+                    counts["unchanged"] += 1
+                else:
+                    to_fetch.append(i)
+
+        # Each trial page and its clinicaltrials.gov lookup run on the pool.
+        # Results are slotted back in link order so the stable sort below
+        # gives exactly the same ordering as a serial walk.
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            futures = {
+                pool.submit(_with_host_limit, per_host_limit, http_stats, scrape_irish_trial, trial_links[i], country,
+                            cancer_type): i
+                for i in to_fetch
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    print(f"Error with trial: {trial_links[i]} -> {e}")
+                    continue
+                if on_trial and results[i]:
+                    on_trial(results[i]["record"])
 
-            except Exception as e:
-                print(f"Error with trial: {link} -> {e}")
+        trial_entries = [entry for entry in results if entry]
 
         # Sort Irish trials by exclusion count
-        trial_entries.sort(key=lambda t: t["exclusion_count"])
+        trial_entries.sort(key=lambda t: t["record"]["exclusion_count"])
         for i, entry in enumerate(trial_entries, 1):
-            with open(entry["filename"], mode="w", newline="", encoding="utf-8") as file:
-                csv.writer(file).writerows(entry["rows"])
-            print(f"{i}. {os.path.basename(entry['filename'])} — Exclusions: {entry['exclusion_count']}")
-
-        return [entry["filename"] for entry in trial_entries]
+            record = entry["record"]
+            if write_csv and "rows" in entry:
+                record["filename"] = entry["filename"]
+                content_hash = rows_hash(entry["rows"])
+                previous = manifest.get(entry["link"])
+                if incremental and previous and previous.get("hash") == content_hash and os.path.exists(record["filename"]):
+                    counts["unchanged"] += 1
+                else:
+                    os.makedirs(cancer_dir, exist_ok=True)
+                    write_trial_rows(record["filename"], entry["rows"])
+                    counts["changed" if previous else "added"] += 1
+                manifest[entry["link"]] = manifest_entry(record, content_hash, entry["last_update"])
+            print(f"{i}. {record['name']} — Exclusions: {record['exclusion_count']}")
+
+        if incremental:
+            counts["removed"] = remove_stale_trials(cancer_dir, manifest, set(trial_links))
+            print_sync_counts(cancer_type, country, counts)
+        if write_csv and os.path.isdir(cancer_dir):
+            save_manifest(cancer_dir, manifest)
+        if stats is not None:
+            stats.update(counts)
+
+        http_stats = http_client.connection_stats(http_stats)
+        print(f"HTTP: {http_stats['requests']} requests, {http_stats['opened']} connections opened, {http_stats['reused']} reused")
+
+        records = [entry["record"] for entry in trial_entries]
 
     else:
         output_dir = os.path.join("trials_data", country.lower().replace(" ", "_"))
-        return extract_trial_data_in_eu(cancer_type, country, output_dir)
\ No newline at end of file
+        records = extract_trial_data_in_eu(cancer_type, country, output_dir, incremental=incremental, stats=stats,
+                                           on_trial=on_trial, write_csv=write_csv)
+
+    if write_csv:
+        update_catalogue(country, cancer_type, records)
+    return records
+
+def update_catalogue(country, cancer_type, records):
+    # The catalogue is a side output like the CSVs; a failure here should not lose the scrape.
+    if not records:
+        return
+    try:
+        with metrics.span("scraper_stage_duration_seconds", stage="catalogue_update"):
+            result = catalogue.record_scrape(country, cancer_type, records)
+        eligibility_cache.invalidate_trials(result["changed"] + result["removed"])
+    except Exception as e:
+        print(f"Catalogue update failed for {cancer_type} in {country}: {e}")
+
+def refresh_all_trials(cancer_types=None, countries=None):
+    # Nightly job: incremental refresh of every cancer type in every EU country.
+    totals = {"added": 0, "changed": 0, "removed": 0, "unchanged": 0}
+    for country in countries or EU_COUNTRIES:
+        for cancer_type in cancer_types or CANCER_URLS:
+            counts = {}
+            try:
+                scrape_trials(cancer_type, country, incremental=True, stats=counts)
+            except Exception as e:
+                print(f"Refresh failed for {cancer_type} in {country}: {e}")
+            for key, value in counts.items():
+                totals[key] += value
+    print_sync_counts("All cancer types", "all countries", totals)
+    return totals
+
+if __name__ == "__main__":
+    refresh_all_trials()
@@ -1,4 +1,5 @@
 import pandas as pd
+import numpy as np
 import json
 
 def load_trials(trial_path):
@@ -55,17 +56,120 @@ def check_eligibility(patient, trial):
 
     return eligible, reasons
 
+# One bit per criterion in the failure masks returned by screen_matrix.
+AGE = 1 << 0
+ECOG = 1 << 1
+DIAGNOSIS = 1 << 2
+STAGE = 1 << 3
+PRIOR_TREATMENT = 1 << 4
+MEASURABLE_DISEASE = 1 << 5
+PRIOR_LINES = 1 << 6
+COMORBIDITY = 1 << 7
+
+CRITERIA = {
+    AGE: "age_min",
+    ECOG: "ecog_max",
+    DIAGNOSIS: "diagnosis",
+    STAGE: "staging",
+    PRIOR_TREATMENT: "prior_treatment",
+    MEASURABLE_DISEASE: "measurable_disease",
+    PRIOR_LINES: "prior_treatment_lines",
+    COMORBIDITY: "comorbidities",
+}
+
+class PatientColumns:
+    # Column views shared by every trial in a batch. String columns are
+    # factorized once so membership and substring tests run per distinct value.
+    def __init__(self, patients):
+        self.patients = patients
+        self._numbers = {}
+        self._factors = {}
+
+    def __len__(self):
+        return len(self.patients)
+
+    def number(self, name):
+        if name not in self._numbers:
+            self._numbers[name] = pd.to_numeric(self.patients[name], errors="coerce").to_numpy(dtype=float)
+        return self._numbers[name]
+
+    def factor(self, name):
+        if name not in self._factors:
+            codes, uniques = pd.factorize(self.patients[name])
+            self._factors[name] = (codes, np.asarray(uniques, dtype=object))
+        return self._factors[name]
+
+    def per_value(self, name, test):
+        # Runs test on each distinct value and spreads the result to all rows.
+        codes, uniques = self.factor(name)
+        result = np.fromiter((test(v) for v in uniques), dtype=bool, count=len(uniques))
+        # Missing values are factorized to -1 and get the result for NaN.
+        return np.where(codes >= 0, result[codes] if len(uniques) else False, test(np.nan))
+
+def compile_trial(trial):
+    # Returns [(bit, predicate)] where predicate(columns) is True for rows that
+    # fail the criterion. Mirrors check_eligibility exactly.
+    inc = trial["inclusion_criteria"]
+    exc = trial["exclusion_criteria"]
+    checks = []
+
+    if "age_min" in inc:
+        checks.append((AGE, lambda c, v=inc["age_min"]: c.number("age") < v))
+    if "ecog_max" in inc:
+        checks.append((ECOG, lambda c, v=inc["ecog_max"]: c.number("ecog") > v))
+    if "diagnosis" in inc:
+        allowed = set(inc["diagnosis"])
+        checks.append((DIAGNOSIS, lambda c: c.per_value("diagnosis", lambda v: v not in allowed)))
+    if "staging" in inc:
+        stages = set(inc["staging"])
+        checks.append((STAGE, lambda c: c.per_value("stage", lambda v: v not in stages)))
+    if "prior_treatment" in inc:
+        treatments = set(inc["prior_treatment"])
+        checks.append((PRIOR_TREATMENT, lambda c: c.per_value("treatment_history", lambda v: v not in treatments)))
+    if inc.get("measurable_disease"):
+        checks.append((MEASURABLE_DISEASE, lambda c: c.per_value("measurable_disease", lambda v: not v)))
+
+    if "prior_treatment_lines" in exc:
+        max_lines = int(exc["prior_treatment_lines"].replace(">", ""))
+        checks.append((PRIOR_LINES, lambda c: c.number("prior_lines") > max_lines))
+    if exc.get("comorbidities"):
+        conditions = [condition.lower() for condition in exc["comorbidities"]]
+        checks.append((COMORBIDITY, lambda c: c.per_value(
+            "comorbidities", lambda v: isinstance(v, str) and any(cond in v.lower() for cond in conditions)
+        )))
+
+    return checks
+
+def screen_matrix(patients, trials, compiled=None):
+    # Screens every patient against every trial in one pass. Returns boolean
+    # eligibility and uint16 failure bitmasks, both shaped (patients, trials).
+    columns = patients if isinstance(patients, PatientColumns) else PatientColumns(patients)
+    compiled = compiled or [compile_trial(trial) for trial in trials]
+    failures = np.zeros((len(columns), len(compiled)), dtype=np.uint16)
+    for j, checks in enumerate(compiled):
+        for bit, failing in checks:
+            failures[:, j] |= np.where(failing(columns), bit, 0).astype(np.uint16)
+    return {"eligible": failures == 0, "failures": failures}
+
+def failed_criteria(mask):
+    return [CRITERIA[bit] for bit in CRITERIA if mask & bit]
+
+def explain(patients, trials, i, j):
+    # Human-readable reasons for one (patient, trial) cell, built on demand.
+    return check_eligibility(patients.iloc[i], trials[j])[1]
+
 def screen_all(patients_csv, trials_json):
     patients = load_patients(patients_csv)
     trials = load_trials(trials_json)
+    result = screen_matrix(patients, trials)
 
-    for idx, patient in patients.iterrows():
-        print(f"\n--- Patient {patient['patient_id']} ---")
-        for trial in trials:
-            eligible, reasons = check_eligibility(patient, trial)
+    for i, patient_id in enumerate(patients["patient_id"]):
+        print(f"\n--- Patient {patient_id} ---")
+        for j, trial in enumerate(trials):
+            eligible = result["eligible"][i, j]
             print(f"Trial: {trial['name']} --> {'✅ Eligible' if eligible else '❌ Ineligible'}")
-            if reasons:
-                for r in reasons:
+            if not eligible:
+                for r in explain(patients, trials, i, j):
                     print("   ↳", r)
 
 # Run screening
@@ -0,0 +1,17 @@
+# wsgi.py
+#
+# Production entry point. Run from the repository directory, e.g.
+#
+#   SECRET_KEY=... gunicorn --workers 4 --bind 0.0.0.0:5000 wsgi:app
+#   SECRET_KEY=... waitress-serve --port=5000 wsgi:app      (Windows)
+#
+# Patients, logs, admins, the catalogue and the HTTP cache are shared through
+# files and SQLite databases under this directory, so workers can be added
+# freely. Two things are still kept by the worker that made them: screening
+# result pages (/screening_results) and scrape job progress (/scrape_status,
+# /scrape_events). Behind several workers those need a load balancer with
+# session affinity, or gunicorn's --threads on a single worker.
+
+from app import app, configure
+
+configure(app)